@@ -0,0 +1,155 @@
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import argparse
+import csv
+import itertools
+import multiprocessing
+import random
+import sys
+import time
+
+from pygame.locals import K_LEFT, K_RIGHT, K_UP
+
+from game import Simulation, Inputs, NUM_ENEMY, P_BULLET_DELAY, E_BULLET_DELAY, MAX_BULLETS, BOSS_HP
+from bench import percentile
+
+# Parameters swept by the batch, in column order: (flag, Game keyword, default).
+PARAMS = (
+    ('enemies', 'num_enemy', NUM_ENEMY),
+    ('p_bullet_delay', 'p_bullet_delay', P_BULLET_DELAY),
+    ('e_bullet_delay', 'e_bullet_delay', E_BULLET_DELAY),
+    ('boss_hp', 'boss_hp', BOSS_HP),
+    ('max_bullets', 'max_bullets', MAX_BULLETS),
+)
+
+# Bots map (game, tick) to the keys held on that tick. Neither ever
+# presses K_DOWN, which would pause the game.
+class RandomBot:
+    KEYS = ([], [K_LEFT], [K_RIGHT], [K_UP], [K_LEFT, K_UP], [K_RIGHT, K_UP])
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.inputs = Inputs()
+        self.hold = 0
+    def __call__(self, game, tick):
+        if self.hold == 0:
+            # Right-leaning, or most sessions never reach the end of the level.
+            self.inputs = Inputs(self.rng.choices(self.KEYS, (1, 1, 4, 1, 1, 2))[0])
+            self.hold = self.rng.randint(5, 30)
+        self.hold -= 1
+        return self.inputs
+
+class ScriptedBot:
+    def __init__(self, seed):
+        pass
+    def __call__(self, game, tick):
+        keys = [K_UP] if tick % 20 == 0 else []
+        if game.isBossAppeared and game.boss.rect.centerx < game.player.rect.centerx:
+            keys.append(K_LEFT) # turn to face the boss
+        else:
+            keys.append(K_RIGHT)
+        return Inputs(keys)
+
+BOTS = {'random': RandomBot, 'scripted': ScriptedBot}
+
+RESULTS = {1: 'victory', -1: 'defeat', 0: 'timeout'}
+
+# One headless session; runs in a worker process.
+def play(job):
+    params, seed, bot_name, max_ticks = job
+    sim = Simulation(seed, **{keyword: params[name] for name, keyword, default in PARAMS})
+    game = sim.game
+    bot = BOTS[bot_name](seed)
+    times = []
+    ticks_to_boss = None
+    while not sim.result and sim.ticks < max_ticks:
+        inputs = bot(game, sim.ticks)
+        start = time.perf_counter()
+        sim.step(inputs)
+        times.append(time.perf_counter() - start)
+        if ticks_to_boss is None and game.isBossAppeared:
+            ticks_to_boss = sim.ticks
+    score = sim.score
+    if score is None: # timed out: score the session as it stands
+        score = game.score()
+    row = dict(params)
+    row.update({
+        'seed': seed,
+        'bot': bot_name,
+        'result': RESULTS[sim.result],
+        'score': score,
+        'ticks': sim.ticks,
+        'ticks_to_boss': ticks_to_boss,
+        'mean_tick_us': round(sum(times) / len(times) * 1e6, 2) if times else 0,
+        'p99_tick_us': round(percentile(times, 99) * 1e6, 2),
+    })
+    return row
+
+def mean(values):
+    return round(sum(values) / len(values), 2) if values else None
+
+# One row per parameter combination, over all of its seeds.
+def summarize(rows):
+    names = [name for name, keyword, default in PARAMS]
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[name] for name in names), []).append(row)
+    summary = []
+    for key in sorted(groups):
+        group = groups[key]
+        boss = [row['ticks_to_boss'] for row in group if row['ticks_to_boss'] is not None]
+        out = dict(zip(names, key))
+        out.update({
+            'sessions': len(group),
+            'victory_rate': round(sum(row['result'] == 'victory' for row in group) / len(group), 4),
+            'defeat_rate': round(sum(row['result'] == 'defeat' for row in group) / len(group), 4),
+            'mean_score': mean([row['score'] for row in group]),
+            'boss_reached': len(boss),
+            'mean_ticks_to_boss': mean(boss),
+            'mean_tick_us': mean([row['mean_tick_us'] for row in group]),
+        })
+        summary.append(out)
+    return summary
+
+def writeCsv(path, rows):
+    with open(path, 'w', newline = '') as f:
+        writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def jobs(args):
+    values = [getattr(args, name) or [default] for name, keyword, default in PARAMS]
+    for combo in itertools.product(*values):
+        params = {name: value for (name, keyword, default), value in zip(PARAMS, combo)}
+        for seed in range(args.seed_base, args.seed_base + args.seeds):
+            yield params, seed, args.bot, args.max_ticks
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description = 'Play headless sessions across a grid of tuning parameters.')
+    for name, keyword, default in PARAMS:
+        parser.add_argument('--' + name.replace('_', '-'), type = int, nargs = '+', metavar = 'N', help = 'values to sweep (default %d)' % default)
+    parser.add_argument('--seeds', type = int, default = 10, help = 'sessions per parameter combination')
+    parser.add_argument('--seed-base', type = int, default = 1, help = 'first seed; sessions use consecutive seeds')
+    parser.add_argument('--bot', choices = sorted(BOTS), default = 'scripted')
+    parser.add_argument('--max-ticks', type = int, default = 20000, help = 'end a session as a timeout after this many ticks')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'worker processes (default: every core)')
+    parser.add_argument('--out', metavar = 'FILE', default = 'runs.csv', help = 'one row per session')
+    parser.add_argument('--summary', metavar = 'FILE', default = 'summary.csv', help = 'one row per parameter combination')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parseArgs(argv)
+    todo = list(jobs(args))
+    rows = []
+    with multiprocessing.Pool(args.workers) as pool:
+        # Sessions vary a lot in length, so hand them out one at a time.
+        for row in pool.imap_unordered(play, todo):
+            rows.append(row)
+            print('\r%d/%d sessions' % (len(rows), len(todo)), end = '', file = sys.stderr, flush = True)
+    print(file = sys.stderr)
+    rows.sort(key = lambda row: tuple(row[name] for name, keyword, default in PARAMS) + (row['seed'],))
+    writeCsv(args.out, rows)
+    writeCsv(args.summary, summarize(rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import pygame
+from pygame.locals import K_RIGHT, K_UP
+
+from game import Game, Inputs, Renderer, History, PLAYER, ENEMY, SCREEN_WIDTH, SCREEN_HEIGHT, NUM_ENEMY, MAX_WIDTH, LADDER_ROWS, ACTIVE_MARGIN, REWIND_SECONDS, SIM_RATE
+
+# Each scenario maps (game, tick) to the keys held on that tick, plus an
+# optional setup hook run once after the Game is built.
+def runRight(game, tick):
+    return Inputs([K_RIGHT])
+
+def runRightJump(game, tick):
+    return Inputs([K_RIGHT, K_UP]) if tick % 20 == 0 else Inputs([K_RIGHT])
+
+def idle(game, tick):
+    return Inputs()
+
+def clearEnemies(game):
+    game.clearEnemies()
+
+SCENARIOS = {
+    'run_right': (runRight, None),
+    'run_right_jump': (runRightJump, None),
+    'idle': (idle, None),
+    'boss': (idle, clearEnemies),
+}
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+        self.current = {}
+        self.last = 0
+    def begin(self):
+        self.current = {}
+        self.last = time.perf_counter()
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0) + now - self.last
+        self.last = now
+    def end(self):
+        for phase, t in self.current.items():
+            self.phases.setdefault(phase, []).append(t)
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def summary(values, ticks):
+    # Phases that are skipped on some ticks count as zero there.
+    values = values + [0] * (ticks - len(values))
+    return {
+        'mean_us': round(sum(values) / ticks * 1e6, 2) if ticks else 0,
+        'p50_us': round(percentile(values, 50) * 1e6, 2),
+        'p99_us': round(percentile(values, 99) * 1e6, 2),
+    }
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    script, setup = SCENARIOS[args.scenario]
+    game = Game(args.seed, num_enemy = args.enemies, max_width = args.max_width, ladders = args.ladders,
+                active_margin = None if args.active_margin < 0 else args.active_margin)
+    game.player.num_bullets = args.player_bullets
+    game.player.hurted = lambda dam: False # keep the scenario running for the whole benchmark
+    if setup:
+        setup(game)
+    renderer = Renderer(pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))) if args.draw else None
+    history = History(REWIND_SECONDS * SIM_RATE) if args.snapshot else None
+    timer = PhaseTimer()
+    game.timer = timer
+    ticks = []
+    blocks = 0
+    gen0 = gc.get_stats()[0]['collections']
+    for tick in range(args.ticks):
+        inputs = script(game, tick)
+        before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        timer.begin()
+        score, result = game.step(inputs)
+        if game.isBossAppeared:
+            game.boss.num_bullets = args.boss_bullets
+        if history is not None and not result:
+            timer.last = time.perf_counter()
+            data = game.snapshot()
+            history.push(data)
+            timer.mark('snapshot')
+            game.restore(data)
+            timer.mark('restore')
+        if renderer:
+            timer.last = time.perf_counter()
+            renderer.draw(game)
+            timer.mark('draw')
+        timer.end()
+        ticks.append(time.perf_counter() - start)
+        blocks += sys.getallocatedblocks() - before
+        if result:
+            break
+    n = len(ticks)
+    return {
+        'scenario': args.scenario,
+        'commit': commit(),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'config': {
+            'seed': game.seed,
+            'enemies': args.enemies,
+            'max_width': args.max_width,
+            'ladders': args.ladders,
+            'player_bullets': args.player_bullets,
+            'boss_bullets': args.boss_bullets,
+            'active_margin': args.active_margin,
+            'draw': args.draw,
+            'snapshot': args.snapshot,
+        },
+        'ticks': n,
+        'tick': summary(ticks, n),
+        'phases': {phase: summary(values, n) for phase, values in timer.phases.items()},
+        'allocations': {
+            'net_blocks_per_tick': round(blocks / n, 2) if n else 0,
+            'gc_gen0_collections': gc.get_stats()[0]['collections'] - gen0,
+        },
+        'pools': game.poolStats(),
+        'history': history.stats() if history is not None else None,
+        'render': dict(renderer.stats(), static_tile_builds = renderer.static.builds) if renderer else None,
+        'entities': {
+            'enemies': len(game.enemies),
+            'p_bullets': game.bullets.countOf(PLAYER),
+            'e_bullets': game.bullets.countOf(ENEMY),
+            'items': len(game.items),
+        },
+    }
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description = 'Time Game.step under scripted stress scenarios.')
+    parser.add_argument('--scenario', choices = sorted(SCENARIOS), default = 'run_right')
+    parser.add_argument('--ticks', type = int, default = 1000)
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--enemies', type = int, default = NUM_ENEMY)
+    parser.add_argument('--max-width', type = int, default = MAX_WIDTH)
+    parser.add_argument('--ladders', type = int, default = len(LADDER_ROWS), help = 'ladders per screen')
+    parser.add_argument('--player-bullets', type = int, default = 1, help = 'bullets in each player spread')
+    parser.add_argument('--boss-bullets', type = int, default = 3, help = 'bullets in each boss fan')
+    parser.add_argument('--active-margin', type = int, default = ACTIVE_MARGIN, help = 'tick enemies this far outside the view; -1 ticks them all')
+    parser.add_argument('--draw', action = 'store_true', help = 'also render each tick to an off-screen surface')
+    parser.add_argument('--snapshot', action = 'store_true', help = 'also snapshot and restore the game each tick, keeping a rewind history')
+    parser.add_argument('--out', metavar = 'FILE', help = 'write the JSON report to FILE instead of stdout')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parseArgs(argv)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.font.init()
+    report = run(args)
+    text = json.dumps(report, indent = 2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
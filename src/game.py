@@ -1,6 +1,18 @@
+import time
+START = time.perf_counter() # for time to first frame
 import pygame
 import math
 import random
+import struct
+import threading
+import zlib
+import argparse
+import collections
+import json
+import os
+import numpy as np
+from bisect import bisect_left, insort
+from level import Level
 from pygame.locals import (
     RLEACCEL,
     K_UP,
@@ -9,6 +21,7 @@ from pygame.locals import (
     K_RIGHT,
     K_ESCAPE,
     K_BACKSPACE,
+    K_F3,
     KEYDOWN,
     QUIT,
     MOUSEBUTTONDOWN,
@@ -21,7 +34,28 @@ V_JUMP = -40
 GRAVITY = 5
 P_BULLET_DELAY = 10
 E_BULLET_DELAY = 50
+MAX_BULLETS = 5 # cap on the player's spread from AddBullet pickups
+BOSS_HP = 1000
 NUM_ENEMY = 50
+LADDER_ROWS = (0.25, 0.5, 0.75)
+CELL_SIZE = 128
+ACTIVE_MARGIN = SCREEN_WIDTH // 2 # enemies this far outside the view still get full ticks
+CHUNK_WIDTH = SCREEN_WIDTH
+LOAD_MARGIN = SCREEN_WIDTH # chunks this close to the view are loaded
+EVICT_MARGIN = 2*SCREEN_WIDTH # and packed away again once they are further than this
+TILE_WIDTH = SCREEN_WIDTH # of the pre-drawn static level; the view spans at most two tiles
+CULL_MARGIN = 64 # px past the view an enemy may be and still be drawn in view between ticks
+BATCH_MIN = 16 # fewest actors Bodies.step moves as one NumPy batch
+AI_BATCH_MIN = 40 # and Swarm decides for as one batch (it makes more NumPy calls)
+BULLET_SPEED = 15
+BULLET_DAMAGE = 10
+SIM_RATE = 30 # simulation ticks per second; every per-tick speed and GRAVITY is tuned for this
+FPS = 60 # render frames per second
+MAX_CATCHUP = 5 # most simulation ticks run in one frame before falling behind is accepted
+REWIND_SECONDS = 10 # how far back BACKSPACE can rewind
+AUTOSAVE_SECONDS = 30 # of play between autosaves
+COIN_FPS = 12
+BOB_FPS = 15
 
 def rescaleSprite(surface, scale):
     w, h = surface.get_size()
@@ -29,131 +63,715 @@ def rescaleSprite(surface, scale):
     new_w = w * new_h // h
     return pygame.transform.scale(surface, (new_w, new_h))
 
-class Coin(pygame.sprite.Sprite):
+# Decoded PNGs, and the scaled/rotated/flipped surfaces built from them.
+# Surfaces handed out by loadSprite are shared: never draw onto them.
+_images = {}
+_sprites = {}
+_decoded = threading.Lock()
+
+def loadImage(path):
+    image = _images.get(path)
+    if image is None:
+        with _decoded: # not twice if preload() is on it
+            image = _images.get(path)
+            if image is None:
+                image = pygame.image.load(path)
+                _images[path] = image
+    return image
+
+# Every PNG a game session uses. preload() decodes them on a worker thread
+# while the menu is up, along with importing numpy.random (NumPy only
+# loads it on first use, which is most of the first Game()). The scaling
+# and convert_alpha() in loadSprite stay on the main thread.
+GAME_IMAGES = ['Sprites/Character/player.png', 'Sprites/Monsters/enemy.png', 'Sprites/Bullets/bullet.png'] + \
+              [f'Sprites/Items/coin{i}.png' for i in range(1, 9)]
+
+def preload(paths = GAME_IMAGES):
+    def run():
+        np.random.default_rng
+        for path in paths:
+            loadImage(path)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    return thread
+
+def loadSprite(path, scale, rotation = 0, flip = False):
+    key = (path, scale, rotation, flip)
+    image = _sprites.get(key)
+    if image is None:
+        image = rescaleSprite(loadImage(path), scale)
+        if rotation:
+            image = pygame.transform.rotate(image, rotation)
+        if flip:
+            image = pygame.transform.flip(image, True, False)
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+            image.set_alpha(255, RLEACCEL) # blits skip the transparent runs; about twice as fast for the sprites here
+        _sprites[key] = image
+    return image
+
+# Frames are anything indexed by time: surfaces for the coin spin, pixel
+# offsets for the power-up bob. Playback speed is independent of the tick rate.
+class Animation:
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+    def frame(self, t):
+        return self.frames[int(t * self.fps / 1000) % len(self.frames)]
+
+_animations = {}
+
+def loadAnimation(paths, scale, fps):
+    key = (tuple(paths), scale, fps)
+    anim = _animations.get(key)
+    if anim is None:
+        anim = Animation([loadSprite(path, scale) for path in paths], fps)
+        _animations[key] = anim
+    return anim
+
+# Sprites live in world coordinates; the camera only holds the viewport
+# offset, so scrolling never touches the sprites themselves.
+class Camera:
+    def __init__(self, width, height, max_width):
+        self.x = 0
+        self.prev_x = 0
+        self.max_x = max_width - width
+        self.view = pygame.Rect(0, 0, width, height)
+    def scroll(self, dx):
+        self.x = min(max(self.x + dx, 0), self.max_x)
+        self.view.x = self.x
+    def follow(self, rect):
+        left = rect.left - self.x
+        if left > self.view.width // 2 and self.x < self.max_x: # chuyen canh khi player di sang phai
+            self.scroll(left - self.view.width // 2)
+        elif left < 10 and self.x > 0: # chuyen canh khi player di sang trai
+            self.scroll(left - 10)
+    def offset(self, alpha = 1):
+        return round(self.prev_x + (self.x - self.prev_x) * alpha)
+
+# Platforms bucketed into columns of the level by x, each column kept
+# sorted by top. Finding the platforms that overlap a rect, or the first
+# one a falling actor passed through, is a bisect per column instead of a
+# scan over every platform. Overlap queries return sprites in insertion
+# order, matching what pygame.sprite.spritecollide/groupcollide would.
+class PlatformIndex:
+    def __init__(self, cell_size = CELL_SIZE):
+        self.cell_size = cell_size
+        self.columns = {} # column -> [(top, order, sprite)], sorted
+        self.order = {}
+        self.added = 0
+        self.max_height = 0
+    def columnsOf(self, left, right):
+        c = self.cell_size
+        return range(left // c, (right - 1) // c + 1)
+    def add(self, sprite):
+        entry = (sprite.rect.top, self.added, sprite)
+        self.order[sprite] = self.added
+        self.added += 1
+        for col in self.columnsOf(sprite.rect.left, sprite.rect.right):
+            insort(self.columns.setdefault(col, []), entry)
+        self.max_height = max(self.max_height, sprite.rect.height)
+    def remove(self, sprite):
+        order = self.order.pop(sprite, None)
+        if order is None:
+            return
+        entry = (sprite.rect.top, order, sprite)
+        for col in self.columnsOf(sprite.rect.left, sprite.rect.right):
+            column = self.columns[col]
+            del column[bisect_left(column, entry)]
+            if not column:
+                del self.columns[col]
+    def build(self, sprites):
+        self.columns.clear()
+        self.order.clear()
+        self.added = 0
+        self.max_height = 0
+        for sprite in sprites:
+            self.add(sprite)
+    # Platforms overlapping rect, in the order they were added.
+    def query(self, rect):
+        found = {}
+        low = (rect.top - self.max_height + 1,)
+        high = (rect.bottom,)
+        for col in self.columnsOf(rect.left, rect.right):
+            column = self.columns.get(col)
+            if column:
+                for top, order, sprite in column[bisect_left(column, low):bisect_left(column, high)]:
+                    if rect.colliderect(sprite.rect):
+                        found[order] = sprite
+        return [found[order] for order in sorted(found)]
+    # The highest top in [y0, y1] of a platform under [left, right): the
+    # first one crossed by feet moving down from y0 to y1. None if none.
+    def crossed(self, left, right, y0, y1):
+        best = None
+        for col in self.columnsOf(left, right):
+            column = self.columns.get(col)
+            if not column:
+                continue
+            for k in range(bisect_left(column, (y0,)), len(column)):
+                top, order, sprite = column[k]
+                if top > y1 or (best is not None and top >= best):
+                    break
+                if sprite.rect.left < right and sprite.rect.right > left:
+                    best = top
+                    break
+        return best
+    def spritecollide(self, sprite, dokill):
+        hits = self.query(sprite.rect)
+        if dokill:
+            for hit in hits:
+                self.remove(hit)
+                hit.kill()
+        return hits
+    def groupcollide(self, sprites, dokilla, dokillb):
+        crashed = {}
+        for sprite in list(sprites):
+            hits = self.spritecollide(sprite, dokillb)
+            if hits:
+                crashed[sprite] = hits
+                if dokilla:
+                    sprite.kill()
+        return crashed
+
+# Buckets sprites into vertical strips of the level so the ones near the
+# view can be found without looking at the rest. Sprites are re-bucketed
+# with move() only when they are ticked, which is fine because sleeping
+# sprites do not move.
+class ActivityGrid:
+    def __init__(self, cell_size = SCREEN_WIDTH // 2):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.where = {}
+        self.order = {}
+        self.added = 0
+    def add(self, sprite):
+        self.order[sprite] = self.added
+        self.added += 1
+        col = sprite.rect.centerx // self.cell_size
+        self.cells.setdefault(col, set()).add(sprite)
+        self.where[sprite] = col
+    def remove(self, sprite):
+        col = self.where.pop(sprite, None)
+        if col is not None:
+            self.cells[col].discard(sprite)
+            if not self.cells[col]:
+                del self.cells[col]
+            del self.order[sprite]
+    def move(self, sprite):
+        col = sprite.rect.centerx // self.cell_size
+        old = self.where[sprite]
+        if col != old:
+            self.cells[old].discard(sprite)
+            if not self.cells[old]:
+                del self.cells[old]
+            self.cells.setdefault(col, set()).add(sprite)
+            self.where[sprite] = col
+    def query(self, left, right):
+        found = []
+        c = self.cell_size
+        # centers are bucketed, so look one strip further for wide sprites
+        for col in range(left // c - 1, right // c + 2):
+            cell = self.cells.get(col)
+            if cell:
+                found.extend(sprite for sprite in cell if sprite.rect.right > left and sprite.rect.left < right)
+        found.sort(key = self.order.__getitem__)
+        return found
+
+class AnimationClock:
+    def __init__(self):
+        self.time = 0
+    def tick(self, ms):
+        self.time += ms
+
+# Recycles killed sprites: acquire() hands back a free one, reset() to
+# the new arguments, and only builds a new one when none is free.
+class Pool:
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.live = 0
+        self.hits = 0
+        self.misses = 0
+        self.high_water = 0
+    def reserve(self, n):
+        while len(self.free) + self.live < n:
+            obj = self.factory((0, 0))
+            obj.pool = self
+            self.free.append(obj)
+    def acquire(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.reset(*args)
+            self.hits += 1
+        else:
+            obj = self.factory(*args)
+            obj.pool = self
+            self.misses += 1
+        self.live += 1
+        if self.live > self.high_water:
+            self.high_water = self.live
+        return obj
+    def release(self, obj):
+        self.live -= 1
+        self.free.append(obj)
+    def stats(self):
+        return {'live': self.live, 'free': len(self.free), 'hits': self.hits, 'misses': self.misses, 'high_water': self.high_water}
+
+class Pooled:
+    pool = None
+    def kill(self):
+        alive = self.alive()
+        pygame.sprite.Sprite.kill(self)
+        if alive and self.pool:
+            self.pool.release(self)
+
+class Coin(Pooled, pygame.sprite.Sprite):
     def __init__(self, pos):
         pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Items/coin1.png')
-        self.image = rescaleSprite(self.image, 0.1)
+        self.animation = loadAnimation([f'Sprites/Items/coin{i}.png' for i in range(1, 9)], 0.1, COIN_FPS)
+        self.image = self.animation.frames[0]
         self.rect = self.image.get_rect(topleft = pos)
-        self.count = 0
+        self.born = None
         self.score = 1
         self.addbullet = 0
-    def update(self):
-        self.count = (self.count + 1)%8 + 1
-        self.image = pygame.image.load(f'Sprites/Items/coin{self.count}.png')
-        self.image = rescaleSprite(self.image, 0.1)
+    def reset(self, pos):
+        self.image = self.animation.frames[0]
+        self.rect.topleft = pos
+        self.born = None
+        self.prev = None
+    def update(self, now):
+        if self.born is None:
+            self.born = now
+        self.image = self.animation.frame(now - self.born)
     def draw(self, surface):
         self.image.render(surface, self.rect)
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
-class AddBullet(pygame.sprite.Sprite):
+class AddBullet(Pooled, pygame.sprite.Sprite):
     def __init__(self, pos):
         pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Bullets/bullet.png')
-        self.image = rescaleSprite(self.image, 0.05)
-        self.image = pygame.transform.rotate(self.image, 45)
+        self.image = loadSprite('Sprites/Bullets/bullet.png', 0.05, rotation = 45)
         self.rect = self.image.get_rect(topleft = pos)
-        self.count = 1
+        self.animation = Animation((0, -1), BOB_FPS)
+        self.top = self.rect.top
+        self.born = None
         self.score = 0
         self.addbullet = 2
-    def update(self):
-        self.count = (self.count + 1) % 2
-        if self.count == 0:
-            self.rect.move_ip(0, -1)
-        else:
-            self.rect.move_ip(0, 1)
+    def reset(self, pos):
+        self.rect.topleft = pos
+        self.top = self.rect.top
+        self.born = None
+        self.prev = None
+    def update(self, now):
+        if self.born is None:
+            self.born = now
+        self.rect.top = self.top + self.animation.frame(now - self.born)
     def draw(self, surface):
         self.image.render(surface, self.rect)
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, pos, direct):
-        pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Bullets/bullet.png')
-        self.image = rescaleSprite(self.image, 0.02)
-        self.rect = self.image.get_rect(topleft = pos)
-        self.damage = 10
-        self.velocity = 15
-        self.direct = direct
-    def update(self):
-        d = math.sqrt(self.direct[0]**2 + self.direct[1]**2)
-        self.rect.move_ip(int(self.direct[0]*self.velocity / d), int(self.direct[1]*self.velocity / d))
-        if self.rect.left <0 or self.rect.right > SCREEN_WIDTH or self.rect.top <= 0 or self.rect.bottom >= SCREEN_HEIGHT:
-            self.kill()
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
+PLAYER = 0
+ENEMY = 1
 
+# Every live bullet is a row in a set of parallel arrays, packed into
+# [0, count) in spawn order. Moving, culling and hit tests are done for
+# all bullets at once.
+class Bullets:
+    def __init__(self, capacity = 256):
+        self.image = loadSprite('Sprites/Bullets/bullet.png', 0.02)
+        self.w, self.h = self.image.get_size()
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+        self.high_water = 0
+        self.pos = np.zeros((capacity, 2))
+        self.prev = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.damage = np.zeros(capacity, np.int32)
+        self.owner = np.zeros(capacity, np.int8)
+    def grow(self, capacity):
+        n = self.count
+        for name in ('pos', 'prev', 'vel', 'damage', 'owner'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+    def reserve(self, n):
+        if n > len(self.pos):
+            self.grow(n)
+    def spawn(self, pos, directions, owner, damage = BULLET_DAMAGE, speed = BULLET_SPEED):
+        d = np.asarray(directions, dtype = float).reshape(-1, 2)
+        i = self.count
+        j = i + len(d)
+        capacity = len(self.pos)
+        if j > capacity:
+            self.hits += max(capacity - i, 0)
+            self.misses += j - max(capacity, i)
+            self.grow(max(2 * capacity, j))
+        else:
+            self.hits += j - i
+        if j > self.high_water:
+            self.high_water = j
+        self.pos[i:j] = pos
+        self.prev[i:j] = pos
+        self.vel[i:j] = d * (speed / np.hypot(d[:, 0], d[:, 1]))[:, None]
+        self.damage[i:j] = damage
+        self.owner[i:j] = owner
+        self.count = j
+    def keep(self, mask):
+        k = int(np.count_nonzero(mask))
+        if k == self.count:
+            return
+        n = self.count
+        for a in (self.pos, self.prev, self.vel, self.damage, self.owner):
+            a[:k] = a[:n][mask]
+        self.count = k
+    def update(self, view):
+        n = self.count
+        if not n:
+            return
+        pos = self.pos[:n]
+        self.prev[:n] = pos
+        pos += self.vel[:n]
+        x = np.floor(pos[:, 0])
+        y = np.floor(pos[:, 1])
+        self.keep((x >= view.left) & (x + self.w <= view.right) & (y > view.top) & (y + self.h < view.bottom))
+    def rects(self, owner):
+        idx = np.flatnonzero(self.owner[:self.count] == owner)
+        return idx, np.floor(self.pos[idx])
+    # Kills every bullet of `owner` that overlaps one of `rects`, each by the
+    # first rect it overlaps. Returns (rect index, damage) per killed bullet,
+    # in spawn order.
+    def collide(self, rects, owner):
+        if not self.count or not len(rects):
+            return NO_HITS
+        idx, xy = self.rects(owner)
+        if not len(idx):
+            return NO_HITS
+        r = np.asarray(rects).reshape(-1, 4)
+        left, top = r[:, 0, None], r[:, 1, None]
+        right, bottom = left + r[:, 2, None], top + r[:, 3, None]
+        x, y = xy[:, 0], xy[:, 1]
+        hit = (left < x + self.w) & (x < right) & (top < y + self.h) & (y < bottom)
+        struck = hit.any(axis = 0)
+        if not struck.any():
+            return NO_HITS
+        killed = idx[struck]
+        hits = hit.argmax(axis = 0)[struck], self.damage[killed]
+        alive = np.ones(self.count, bool)
+        alive[killed] = False
+        self.keep(alive)
+        return hits
+    def countOf(self, owner):
+        return int(np.count_nonzero(self.owner[:self.count] == owner))
+    def stats(self):
+        return {'live': self.count, 'free': len(self.pos) - self.count, 'hits': self.hits, 'misses': self.misses, 'high_water': self.high_water}
 
-class Player(pygame.sprite.Sprite):
-    def __init__(self, pos):
+NO_HITS = (np.zeros(0, np.intp), np.zeros(0, np.int32))
+
+def fan(direct, num_bullets, delta_angle):
+    directions = [direct]
+    for i in range (1, (num_bullets+1) // 2):
+        dy = direct[0]*math.tan(delta_angle/180*math.pi * i)
+        directions.append((direct[0], dy))
+        directions.append((direct[0], -dy))
+    return directions
+
+# Vertical motion of every actor (player, enemies, boss), one row per
+# actor in two tables: numbers and flags. Actors walk and decide to jump
+# on their own; step() then runs jumps, gravity and the ground for a batch
+# of them at once. The table owns each actor's y and copies it into
+# rect.top, which the rest of the game reads; x stays in the rect.
+#
+# With a PlatformIndex in `platforms`, an actor falling past a platform
+# lands on it however far it fell this tick (a swept test from the feet's
+# old y to the new one), instead of only when it ends the tick overlapping
+# the platform.
+class Bodies:
+    # Columns of values: rect.top, vJump, bottom_limit (the y the feet rest
+    # on) and rect.top to the feet (rect.height - bottom_distance). Columns
+    # of flags: isJump, isFall, may only jump from the ground, vJump is
+    # zeroed on landing on the floor (those two are the player's), and
+    # lands on platforms.
+    Y, VY, LIMIT, FEET = range(4)
+    JUMPING, FALLING, GROUNDED_JUMP, STOPS, LANDS = range(5)
+    def __init__(self, capacity = 64):
+        self.platforms = None
+        self.values = np.zeros((capacity, 4), np.int64)
+        self.flags = np.zeros((capacity, 5), bool)
+        # Element access through NumPy is slow; single actors go through these.
+        self.v = memoryview(self.values)
+        self.f = memoryview(self.flags)
+        self.free = list(range(capacity - 1, -1, -1))
+    def grow(self, capacity):
+        n = len(self.values)
+        for name in ('values', 'flags'):
+            old = getattr(self, name)
+            new = np.zeros((capacity, old.shape[1]), old.dtype)
+            new[:n] = old
+            setattr(self, name, new)
+        self.v = memoryview(self.values)
+        self.f = memoryview(self.flags)
+        self.free += range(capacity - 1, n - 1, -1)
+    def add(self, y, feet, vy = V_JUMP, grounded_jump = False, stops = False, lands = True):
+        if not self.free:
+            self.grow(2 * len(self.values))
+        i = self.free.pop()
+        self.values[i] = y, vy, SCREEN_HEIGHT, feet
+        self.flags[i] = False, False, grounded_jump, stops, lands
+        return i
+    def release(self, i):
+        self.free.append(i)
+    # (rect.top, vJump, bottom_limit, isJump, isFall)
+    def state(self, i):
+        v, f = self.v, self.f
+        return v[i, 0], v[i, 1], v[i, 2], f[i, 0], f[i, 1]
+    def restore(self, i, y, vy, limit, jumping, falling):
+        v, f = self.v, self.f
+        v[i, 0], v[i, 1], v[i, 2] = y, vy, limit
+        f[i, 0], f[i, 1] = jumping, falling
+    # jumps[k] is whether actors[k] wants to jump this tick. Below
+    # BATCH_MIN actors, NumPy's per-call overhead costs more than it saves,
+    # so they are stepped one at a time instead (stepOne is the same rules).
+    def step(self, actors, jumps):
+        n = len(actors)
+        if n < BATCH_MIN:
+            for actor, jump in zip(actors, jumps):
+                self.stepOne(actor, jump)
+            return
+        i = np.fromiter([actor.slot for actor in actors], np.intp, n)
+        values = self.values[i]
+        flags = self.flags[i]
+        y, vy, limit, feet = values[:, self.Y], values[:, self.VY], values[:, self.LIMIT], values[:, self.FEET]
+        jumping, falling = flags[:, self.JUMPING], flags[:, self.FALLING]
+        start = np.asarray(jumps, bool) & ~jumping & ~(falling & flags[:, self.GROUNDED_JUMP])
+        jumping |= start
+        vy[start] = V_JUMP
+        # jumping, or in the air without having jumped
+        moving = jumping | (y + feet < SCREEN_HEIGHT)
+        falling |= moving & (~jumping | (vy >= 0))
+        y0 = y.copy()
+        np.add(y, vy, out = y, where = moving)
+        np.add(vy, GRAVITY, out = vy, where = moving)
+        limit[falling] = SCREEN_HEIGHT
+        if self.platforms is not None:
+            for k in np.flatnonzero(falling & (y > y0) & flags[:, self.LANDS]).tolist():
+                rect = actors[k].rect
+                top = self.platforms.crossed(rect.left, rect.right, y0[k] + feet[k], y[k] + feet[k])
+                if top is not None:
+                    y[k] = top - feet[k]
+                    limit[k] = top
+                    vy[k] = 0
+        landed = (y > 0) & (y + feet >= limit)
+        np.maximum(y, 0, out = y)
+        np.subtract(limit, feet, out = y, where = landed)
+        flags[landed, :2] = False
+        vy[landed & flags[:, self.STOPS]] = 0
+        self.values[i] = values
+        self.flags[i] = flags
+        # rect.top already matches y0; most actors are standing still
+        tops = y.tolist()
+        for k in np.flatnonzero(y != y0).tolist():
+            actors[k].rect.top = tops[k]
+    def stepOne(self, actor, jump):
+        i = actor.slot
+        v, f = self.v, self.f
+        y, vy, limit, feet = v[i, 0], v[i, 1], v[i, 2], v[i, 3]
+        jumping, falling = f[i, 0], f[i, 1]
+        if jump and not jumping and not (falling and f[i, 2]):
+            jumping = True
+            vy = V_JUMP
+        y0 = y
+        if jumping or y + feet < SCREEN_HEIGHT:
+            if not jumping or vy >= 0:
+                falling = True
+            y += vy
+            vy += GRAVITY
+        if falling:
+            limit = SCREEN_HEIGHT
+            if y > y0 and self.platforms is not None and f[i, 4]:
+                top = self.platforms.crossed(actor.rect.left, actor.rect.right, y0 + feet, y + feet)
+                if top is not None:
+                    y = top - feet
+                    limit = top
+                    vy = 0
+        if y <= 0:
+            y = 0
+        elif y + feet >= limit:
+            y = limit - feet
+            jumping = falling = False
+            if f[i, 3]:
+                vy = 0
+        v[i, 0], v[i, 1], v[i, 2] = y, vy, limit
+        f[i, 0], f[i, 1] = jumping, falling
+        actor.rect.top = y
+    # Stops a falling actor on a platform whose top it has reached.
+    def land(self, actor, top):
+        i = actor.slot
+        if self.f[i, self.FALLING] and top <= actor.rect.bottom:
+            actor.rect.top = top - self.v[i, self.FEET]
+            self.restore(i, actor.rect.top, 0, top, False, False)
+
+# An actor whose vertical motion is run by a Bodies.
+class Body:
+    def addBody(self, bodies, vy = V_JUMP, grounded_jump = False, stops = False, lands = True):
+        self.bodies = Bodies(1) if bodies is None else bodies
+        self.slot = self.bodies.add(self.rect.top, self.rect.height - self.bottom_distance, vy, grounded_jump, stops, lands)
+    def fall(self, land):
+        self.bodies.land(self, land.rect.top)
+    def kill(self):
+        if self.slot is not None:
+            self.bodies.release(self.slot)
+            self.slot = None
+        pygame.sprite.Sprite.kill(self)
+
+# AI state of every enemy, one row each as in Bodies: bulletCounter,
+# bullet_delay, direct[0], isLeft (which way the image faces; it catches
+# up with direct at the end of each tick) and rect.x, which is kept here
+# and written to the rect when it changes. Each tick an enemy draws one
+# number from 0-14: mod 5 it is the move (0 right, 1 left, 2 jump, 3 and
+# 4 chase the player) and // 5 == 1 is the one-in-three chance that it
+# shoots when its fire timer comes round. The numbers of the whole batch
+# come from one call to rng.
+class Swarm:
+    COUNTER, DELAY, FACING, LEFT, X = range(5)
+    def __init__(self, rng = None, capacity = 64):
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.values = np.zeros((capacity, 5), np.int64)
+        self.d = memoryview(self.values)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.enemies = []
+        self.rows = self.rolls = None
+    def grow(self, capacity):
+        n = len(self.values)
+        values = np.zeros((capacity, 5), np.int64)
+        values[:n] = self.values
+        self.values = values
+        self.d = memoryview(values)
+        self.free += range(capacity - 1, n - 1, -1)
+    def add(self, bullet_delay, x):
+        if not self.free:
+            self.grow(2 * len(self.values))
+        i = self.free.pop()
+        self.values[i] = 0, bullet_delay, 1, True, x
+        return i
+    def release(self, i):
+        self.free.append(i)
+    # First half of the tick for the enemies about to act: draws their
+    # numbers, moves their fire timers on and fires those that come up.
+    # Below AI_BATCH_MIN enemies this runs one at a time (see Bodies.step);
+    # either way the same numbers give the same tick.
+    def fire(self, enemies, bullets):
+        n = len(enemies)
+        self.enemies = enemies
+        # (integers() costs several times more than this per call)
+        rolls = (self.rng.random(n) * 15).astype(np.int64)
+        if n < AI_BATCH_MIN:
+            self.rolls = rolls.tolist()
+            d = self.d
+            for enemy, roll in zip(enemies, self.rolls):
+                i = enemy.brain
+                d[i, 0] = counter = (d[i, 0] + 1) % d[i, 1]
+                if counter == 0 and roll // 5 == 1:
+                    rect = enemy.rect
+                    bullets.spawn(((rect.left + rect.right)//2, (rect.top + rect.bottom - enemy.bottom_distance) // 2), (d[i, 2], 0), ENEMY)
+            return
+        self.rolls = rolls
+        self.rows = rows = np.fromiter([enemy.brain for enemy in enemies], np.intp, n)
+        values = self.values
+        counter = (values[rows, self.COUNTER] + 1) % values[rows, self.DELAY]
+        values[rows, self.COUNTER] = counter
+        shots = np.flatnonzero((counter == 0) & (rolls // 5 == 1))
+        if len(shots):
+            pos = []
+            for k in shots.tolist():
+                rect = enemies[k].rect
+                pos.append(((rect.left + rect.right)//2, (rect.top + rect.bottom - enemies[k].bottom_distance) // 2))
+            directions = np.zeros((len(shots), 2))
+            directions[:, 0] = values[rows[shots], self.FACING]
+            bullets.spawn(pos, directions, ENEMY)
+    # Second half: walks the same enemies and returns whether each wants
+    # to jump (see Bodies.step).
+    def think(self, player_rect):
+        enemies = self.enemies
+        n = len(enemies)
+        if n < AI_BATCH_MIN:
+            return [self.thinkOne(enemy, roll % 5, player_rect) for enemy, roll in zip(enemies, self.rolls)]
+        rows = self.rows
+        values = self.values
+        choice = self.rolls % 5
+        x = values[rows, self.X]
+        dx = player_rect.left - x
+        chase = choice >= 3
+        choice[chase & (dx > 0)] = 0
+        choice[chase & (dx < 0)] = 1
+        # right under or over the player: jump if it is higher up
+        for k in np.flatnonzero(chase & (dx == 0)).tolist():
+            if player_rect.top < enemies[k].rect.top:
+                choice[k] = 2
+        walks = choice < 2
+        facing = values[rows, self.FACING]
+        facing[walks] = 1 - 2 * choice[walks]
+        values[rows, self.FACING] = facing
+        new_x = np.maximum(x + 3 * facing * walks, 0)
+        values[rows, self.X] = new_x
+        xs = new_x.tolist()
+        for k in np.flatnonzero(new_x != x).tolist():
+            enemies[k].rect.x = xs[k]
+        left = facing == -1
+        for k in np.flatnonzero(left != values[rows, self.LEFT]).tolist():
+            enemy = enemies[k]
+            enemy.image = enemy.left_image if left[k] else enemy.right_image
+        values[rows, self.LEFT] = left
+        return choice == 2
+    def thinkOne(self, enemy, choice, player_rect):
+        d, i = self.d, enemy.brain
+        x = d[i, 4]
+        if choice >= 3:
+            if player_rect.left > x:
+                choice = 0
+            elif player_rect.left < x:
+                choice = 1
+            elif player_rect.top < enemy.rect.top:
+                choice = 2
+        if choice < 2:
+            d[i, 2] = facing = 1 - 2 * choice
+            d[i, 4] = x = max(x + 3 * facing, 0)
+            enemy.rect.x = x
+        left = d[i, 2] == -1
+        if left != d[i, 3]:
+            d[i, 3] = left
+            enemy.image = enemy.left_image if left else enemy.right_image
+        return choice == 2
+
+class Player(Body, pygame.sprite.Sprite):
+    def __init__(self, pos, bullet_delay = P_BULLET_DELAY, max_bullets = MAX_BULLETS, bodies = None):
         pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Character/player.png')
-        self.image = rescaleSprite(self.image, 0.15)
+        self.bullet_delay = bullet_delay
+        self.max_bullets = max_bullets
+        self.image = loadSprite('Sprites/Character/player.png', 0.15)
         self.bottom_distance = 40
         self.rect = pygame.Rect(pos[0], pos[1], self.image.get_size()[0], self.image.get_size()[1]+self.bottom_distance)
-        self.isJump = False
-        self.vJump = V_JUMP
+        self.addBody(bodies, grounded_jump = True, stops = True)
         self.direct = (1, 0)
         self.bulletCounter = 0
-        self.bottom_limit = SCREEN_HEIGHT
-        self.isFall = False
         self.num_bullets = 1
         self.delta_angle = 15
         self.hp = 100
         
-    def update(self, pressed_keys):
+    def update(self, pressed_keys, view):
         if pressed_keys[K_RIGHT]:
             self.rect.move_ip(8, 0)
             self.direct = (1, 0)
         elif pressed_keys[K_LEFT]:
             self.rect.move_ip(-8, 0)
             self.direct = (-1, 0)
-        if (not self.isJump) and (not self.isFall) and pressed_keys[K_UP]:
-            self.isJump = True
-            self.vJump = V_JUMP
-        if (not self.isJump) and self.rect.bottom  - self.bottom_distance < SCREEN_HEIGHT:
-            self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isJump:
-            if self.vJump >= 0:
-                self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isFall:
-            self.bottom_limit = SCREEN_HEIGHT
-        if self.rect.left < 0:
-            self.rect.left = 0
-        elif self.rect.right > SCREEN_WIDTH:
-            self.rect.right = SCREEN_WIDTH
-        if self.rect.top <= 0:
-            self.rect.top = 0
-        elif self.rect.bottom - self.bottom_distance >= self.bottom_limit:
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.vJump = 0
-            self.isJump = False
-            self.isFall = False
-    def fall(self, land):
-        if self.isFall and land.rect.top <= self.rect.bottom:
-            self.bottom_limit = land.rect.top
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.isJump = False
-            self.isFall = False
-            self.vJump = 0
-    def fire(self):
-        self.bulletCounter = (self.bulletCounter + 1) % P_BULLET_DELAY
+        if self.rect.left < view.left:
+            self.rect.left = view.left
+        elif self.rect.right > view.right:
+            self.rect.right = view.right
+        self.bodies.step([self], [bool(pressed_keys[K_UP])])
+    def fire(self, bullets):
+        self.bulletCounter = (self.bulletCounter + 1) % self.bullet_delay
         if self.bulletCounter == 0:
             pos = (self.rect.left + self.rect.right)//2, (self.rect.top + self.rect.bottom - self.bottom_distance) // 2
-            bullets = pygame.sprite.Group()
-            b = Bullet(pos, self.direct)
-            bullets.add(b)
-            for i in range (1, (self.num_bullets+1) // 2):
-                b = Bullet(pos, (self.direct[0], self.direct[0]*math.tan(self.delta_angle/180*math.pi * i)))
-                bullets.add(b)
-                b = Bullet(pos, (self.direct[0], -self.direct[0]*math.tan(self.delta_angle/180*math.pi * i)))
-                bullets.add(b)
-            return bullets
-        return None
+            bullets.spawn(pos, fan(self.direct, self.num_bullets, self.delta_angle), PLAYER)
     def hurted(self, dam):
         self.hp -= dam
         if self.hp <= 0:
@@ -161,113 +779,101 @@ class Player(pygame.sprite.Sprite):
         return False
     def upgrade(self, addbullet):
         self.num_bullets += addbullet
-        if self.num_bullets > 5:
-            self.num_bullets = 5
-class Enemy(pygame.sprite.Sprite):
-    def __init__(self, pos):
+        if self.num_bullets > self.max_bullets:
+            self.num_bullets = self.max_bullets
+# x, y, hp, bulletCounter, vJump, bottom_limit, flags, lastTick
+ENEMY_RECORD = struct.Struct('<iihhhhBi')
+# kind (COIN or POWERUP), x, y
+ITEM_RECORD = struct.Struct('<Bii')
+COIN = 0
+POWERUP = 1
+
+# Game.snapshot() is SNAPSHOT, the two RNG states, then the enemies as
+# ENEMY_RECORDs, the items as SNAPSHOT_ITEMs, the live bullets' arrays,
+# the loaded and visited chunks as int32s and the saved chunks as a
+# SAVED_CHUNK followed by their bytes. SNAPSHOT holds:
+#   ticks, coins, remaining, camera.x, clock.time, game flags (the last is the boss being dead)
+#   player: x, y, hp, bulletCounter, direct[0], num_bullets, vJump, bottom_limit, body flags
+#   boss (zeros until it appears): x, y, hp, max_hp, bulletCounter, direct[0], isLeft, vJump, bottom_limit, body flags
+#   (the body fields are zeros once it is dead)
+#   how many enemies, items, bullets, loaded, visited and saved chunks follow
+SNAPSHOT = struct.Struct('<IiiidB iiiibiiiB iiiiibBiiB IIIIII')
+RANDOM_STATE = struct.Struct('<625IBd') # random.Random: Mersenne Twister words, gauss_next
+PCG_STATE = struct.Struct('<16s16sBI') # np.random.PCG64: state, inc, has_uint32, uinteger
+SNAPSHOT_ITEM = struct.Struct('<Biiid') # kind, x, y, top, born (-1 before its first update)
+SAVED_CHUNK = struct.Struct('<iII') # chunk, then the lengths of its packed enemies and items
+
+class Enemy(Body, pygame.sprite.Sprite):
+    def __init__(self, pos, rng = random, bullet_delay = E_BULLET_DELAY, bodies = None, swarm = None):
         pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Monsters/enemy.png')
-        self.image = rescaleSprite(self.image, 0.15)
+        self.rng = rng
+        self.left_image = loadSprite('Sprites/Monsters/enemy.png', 0.15)
+        self.right_image = loadSprite('Sprites/Monsters/enemy.png', 0.15, flip = True)
+        self.image = self.left_image
         self.bottom_distance = 40
         self.rect = pygame.Rect(pos[0], pos[1], self.image.get_size()[0], self.image.get_size()[1]+self.bottom_distance)
-        self.isJump = False
-        self.vJump = V_JUMP
-        self.direct = (1, 0)
-        self.bulletCounter = 0
-        self.bottom_limit = SCREEN_HEIGHT
-        self.isFall = False
+        self.addBody(bodies)
+        # Walking and firing are decided for all enemies at once by a Swarm.
+        self.swarm = Swarm() if swarm is None else swarm
+        self.brain = self.swarm.add(bullet_delay, self.rect.x)
         self.hp = 30
-        self.isLeft = True
+        self.lastTick = None
         
-    def update(self, player_rect):
-        choice = random.randint(0, 4)
-        if choice >= 3:
-            if player_rect.left - self.rect.left > 0:
-                choice = 0
-            elif player_rect.left - self.rect.left < 0:
-                choice = 1
-            elif (player_rect.top - self.rect.top < 0):
-                choice = 2
-        if choice == 0:
-            self.rect.move_ip(3, 0)
-            self.direct = (1, 0)
-            
-        elif choice == 1:
-            self.rect.move_ip(-3, 0)
-            self.direct = (-1, 0)
-        if (self.direct[0] == 1 and self.isLeft) or (self.direct[0] == -1 and not self.isLeft):
-            self.image = pygame.transform.flip(self.image, True, False)
-            self.isLeft = not self.isLeft
-        if (not self.isJump) and choice == 2:
-            self.isJump = True
-            self.vJump = V_JUMP
-        if (not self.isJump) and self.rect.bottom  - self.bottom_distance < SCREEN_HEIGHT:
-            self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isJump:
-            if self.vJump >= 0:
-                self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isFall:
-            self.bottom_limit = SCREEN_HEIGHT
-        if self.rect.left < 0:
-            self.rect.left = 0
-        if self.rect.top <= 0:
-            self.rect.top = 0
-        elif self.rect.bottom - self.bottom_distance >= self.bottom_limit:
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.isJump = False
-            self.isFall = False
-    def fall(self, land):
-        if self.isFall and land.rect.top <= self.rect.bottom:
-            self.bottom_limit = land.rect.top
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.isJump = False
-            self.isFall = False
-            self.vJump = 0
-    def fire(self):
-        self.bulletCounter = (self.bulletCounter + 1) % E_BULLET_DELAY
-        if self.bulletCounter == 0:
-            pos = (self.rect.left + self.rect.right)//2, (self.rect.top + self.rect.bottom - self.bottom_distance) // 2
-            # pos = self.rect.left, self.rect.top
-            if random.randint(0, 2) == 1:
-                b = Bullet(pos, self.direct)
-                return b
-        return None
-    def hurted(self, dam):
+    # Called when an enemy is ticked again after sleeping out of range. Only
+    # its fire timer moves on; any shots it would have taken could not
+    # have reached the view.
+    def catchUp(self, ticks):
+        d, i = self.swarm.d, self.brain
+        d[i, 0] = (d[i, 0] + ticks) % d[i, 1]
+    # Everything that can change after spawning, as an ENEMY_RECORD.
+    def pack(self):
+        y, vJump, bottom_limit, isJump, isFall = self.bodies.state(self.slot)
+        d, i = self.swarm.d, self.brain
+        flags = isJump | isFall << 1 | d[i, 3] << 2 | (d[i, 2] == 1) << 3
+        return ENEMY_RECORD.pack(self.rect.x, self.rect.y, self.hp, d[i, 0], vJump, bottom_limit, flags,
+                                 -1 if self.lastTick is None else self.lastTick)
+    def unpack(self, record):
+        self.rect.x, self.rect.y, self.hp, bulletCounter, vJump, bottom_limit, flags, lastTick = record
+        self.bodies.restore(self.slot, self.rect.y, vJump, bottom_limit, bool(flags & 1), bool(flags & 2))
+        d, i = self.swarm.d, self.brain
+        d[i, 0], d[i, 2], d[i, 3], d[i, 4] = bulletCounter, 1 if flags & 8 else -1, bool(flags & 4), self.rect.x
+        self.image = self.left_image if flags & 4 else self.right_image
+        self.lastTick = None if lastTick < 0 else lastTick
+    def kill(self):
+        if self.brain is not None:
+            self.swarm.release(self.brain)
+            self.brain = None
+        Body.kill(self)
+    def hurted(self, dam, coins = Coin, powerups = AddBullet):
         self.hp -= dam
         if self.hp <= 0:
             self.kill()
-            if random.randint(0, 10) == 9:
-                return AddBullet((self.rect.left, self.rect.top))
+            if self.rng.randint(0, 10) == 9:
+                return powerups((self.rect.left, self.rect.top))
             else:
-                return Coin((self.rect.left, self.rect.top))
+                return coins((self.rect.left, self.rect.top))
         return None
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
 
-class Boss(pygame.sprite.Sprite):
-    def __init__(self, pos):
+class Boss(Body, pygame.sprite.Sprite):
+    def __init__(self, pos, rng = random, hp = BOSS_HP, bodies = None):
         pygame.sprite.Sprite.__init__(self)
-        self.image = pygame.image.load('Sprites/Monsters/enemy.png')
-        self.image = rescaleSprite(self.image, 0.6)
+        self.rng = rng
+        self.left_image = loadSprite('Sprites/Monsters/enemy.png', 0.6)
+        self.right_image = loadSprite('Sprites/Monsters/enemy.png', 0.6, flip = True)
+        self.image = self.left_image
         self.bottom_distance = 40
         self.rect = pygame.Rect(pos[0], pos[1], self.image.get_size()[0], self.image.get_size()[1]+self.bottom_distance)
-        self.isJump = False
-        self.vJump = V_JUMP*1.5
+        self.addBody(bodies, int(V_JUMP*1.5), lands = False) # the boss walks through ladders
         self.direct = (1, 0)
         self.bulletCounter = 0
-        self.bottom_limit = SCREEN_HEIGHT
-        self.isFall = False
-        self.hp = 1000
+        self.hp = hp
+        self.max_hp = hp
         self.isLeft = True
         self.delta_angle = 30
         self.num_bullets = 3
         
     def update(self, player_rect):
-        choice = random.randint(0, 2)
+        choice = self.rng.randint(0, 2)
         if player_rect.left - self.rect.left > 0:
             self.rect.move_ip(3, 0)
             self.direct = (1, 0)
@@ -277,60 +883,23 @@ class Boss(pygame.sprite.Sprite):
             self.direct = (-1, 0)
             
         if (self.direct[0] == 1 and self.isLeft) or (self.direct[0] == -1 and not self.isLeft):
-            self.image = pygame.transform.flip(self.image, True, False)
             self.isLeft = not self.isLeft
+            self.image = self.left_image if self.isLeft else self.right_image
             
-        if (not self.isJump) and choice == 1:
-            self.isJump = True
-            self.vJump = V_JUMP
-        if (not self.isJump) and self.rect.bottom  - self.bottom_distance < SCREEN_HEIGHT:
-            self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isJump:
-            if self.vJump >= 0:
-                self.isFall = True
-            self.rect.move_ip(0, self.vJump)
-            self.vJump += GRAVITY
-        if self.isFall:
-            self.bottom_limit = SCREEN_HEIGHT
         if self.rect.left < 0:
             self.rect.left = 0
-        if self.rect.top <= 0:
-            self.rect.top = 0
-        elif self.rect.bottom - self.bottom_distance >= self.bottom_limit:
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.isJump = False
-            self.isFall = False
-    def fall(self, land):
-        if self.isFall and land.rect.top <= self.rect.bottom:
-            self.bottom_limit = land.rect.top
-            self.rect.bottom = self.bottom_limit + self.bottom_distance
-            self.isJump = False
-            self.isFall = False
-            self.vJump = 0
-    def fire(self):
+        self.bodies.step([self], [choice == 1])
+    def fire(self, bullets):
         self.bulletCounter = (self.bulletCounter + 1) % 30
         if self.bulletCounter == 0:
             pos = (self.rect.left + self.rect.right)//2, (self.rect.top + self.rect.bottom - self.bottom_distance) // 2
-            bullets = pygame.sprite.Group()
-            b = Bullet(pos, self.direct)
-            bullets.add(b)
-            for i in range (1, (self.num_bullets+1) // 2):
-                b = Bullet(pos, (self.direct[0], self.direct[0]*math.tan(self.delta_angle/180*math.pi * i)))
-                bullets.add(b)
-                b = Bullet(pos, (self.direct[0], -self.direct[0]*math.tan(self.delta_angle/180*math.pi * i)))
-                bullets.add(b)
-            return bullets
-        return None
+            bullets.spawn(pos, fan(self.direct, self.num_bullets, self.delta_angle), ENEMY)
     def hurted(self, dam):
         self.hp -= dam
         if self.hp <= 0:
             self.kill()
             return True
         return False
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
 
 class Ladder(pygame.sprite.Sprite):
     def __init__(self, pos, width, height, color):
@@ -339,8 +908,6 @@ class Ladder(pygame.sprite.Sprite):
         self.image.fill(color)
         self.rect = pygame.Rect(pos[0], pos[1], width, height)
         self.color = color
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
 
 class Boundary(pygame.sprite.Sprite):
     def __init__(self, pos, width, height):
@@ -348,9 +915,61 @@ class Boundary(pygame.sprite.Sprite):
         self.image = pygame.Surface([width, height])
         self.image.fill((0, 0, 255))
         self.rect = pygame.Rect(pos[0], pos[1], width, height)
-    def trans_screen(self, dx):
-        self.rect.move_ip(-dx, 0)
         
+# SysFont looks the name up with match_font(), which first scans every
+# font on the system (fc-list on Linux) - a good part of a cold start.
+# The path each name matched is kept in FONT_CACHE across runs, so that
+# scan only happens for names not seen before. A name that matched
+# nothing is cached too (it gets pygame's default font); delete the file
+# to look again after installing fonts.
+FONT_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'andyadventure', 'fonts.json')
+_font_paths = None
+
+def fontPath(name):
+    global _font_paths
+    if _font_paths is None:
+        try:
+            with open(FONT_CACHE) as f:
+                _font_paths = json.load(f)
+        except (OSError, ValueError):
+            _font_paths = {}
+    path = _font_paths.get(name, '')
+    if path is None or (path and os.path.exists(path)):
+        return path
+    path = _font_paths[name] = pygame.font.match_font(name)
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE), exist_ok = True)
+        with open(FONT_CACHE, 'w') as f:
+            json.dump(_font_paths, f)
+    except OSError:
+        pass # no cache this run
+    return path
+
+_fonts = {}
+
+def getFont(name, size):
+    font = _fonts.get((name, size))
+    if font is None:
+        font = pygame.font.Font(fontPath(name), size)
+        _fonts[(name, size)] = font
+    return font
+
+# Rendered text never changes and the HUD only shows a few distinct
+# strings, so renders are shared like sprites.
+_texts = {}
+
+def renderText(name, size, text, antialias, color):
+    key = (name, size, text, antialias, color)
+    surf = _texts.get(key)
+    if surf is None:
+        if len(_texts) >= 512:
+            _texts.clear()
+        surf = getFont(name, size).render(text, antialias, color)
+        _texts[key] = surf
+    return surf
+
+# HUD widgets only redraw when the value they show changes; update()
+# returns whether it did.
 class Score(pygame.sprite.Sprite):
     def __init__(self, sprite_img, width, height, pos):
         self.score = 0
@@ -361,16 +980,18 @@ class Score(pygame.sprite.Sprite):
         self.rect = pygame.Rect(pos[0], pos[1], width, height)
         self.W = width
         self.H = height
-        self.font = pygame.font.SysFont("Arial", height)
         self.color = (255, 255, 255)
-        self.icon = pygame.image.load(sprite_img)
-        self.icon = rescaleSprite(self.icon, height / SCREEN_HEIGHT)
-        self.textSurf = self.font.render('x0', 1, self.color)
+        self.icon = loadSprite(sprite_img, height / SCREEN_HEIGHT)
+        self.shown = None
     def update(self):
-        self.textSurf = self.font.render(f'x{self.score}', 1, self.color)
+        if self.score == self.shown:
+            return False
+        self.shown = self.score
+        self.textSurf = renderText("Arial", self.H, f'x{self.score}', 1, self.color)
         self.image.fill((0, 0, 0))
         self.image.blit(self.icon, [0, 0])
         self.image.blit(self.textSurf, [self.icon.get_width()+1, 0])
+        return True
 class PlayerHealth(pygame.sprite.Sprite):
     def __init__(self):
         pygame.sprite.Sprite.__init__(self)
@@ -379,14 +1000,17 @@ class PlayerHealth(pygame.sprite.Sprite):
         self.image = pygame.Surface((self.width, self.height))
         self.rect = pygame.Rect(0, 0, self.width, self.height)
         self.hp_bar = pygame.Surface((500, self.height-10))
-        self.icon = pygame.image.load('Sprites/Character/player.png')
-        self.icon = rescaleSprite(self.icon, self.height / SCREEN_HEIGHT)
+        self.hp_bar.fill((0, 255, 0))
+        self.icon = loadSprite('Sprites/Character/player.png', self.height / SCREEN_HEIGHT)
+        self.hp = None
     def update(self, hp):
+        if hp == self.hp:
+            return False
+        self.hp = hp
         self.image.fill((0, 0, 0))
         self.image.blit(self.icon, [0, 0])
-        self.hp_bar = pygame.Surface(((hp*5 if hp > 0 else 0), self.height-10))
-        self.hp_bar.fill((0, 255, 0))
-        self.image.blit(self.hp_bar, [self.icon.get_width()+1, 5])
+        self.image.blit(self.hp_bar, [self.icon.get_width()+1, 5], (0, 0, (hp*5 if hp > 0 else 0), self.height-10))
+        return True
 class BossHealth(pygame.sprite.Sprite):
     def __init__(self):
         pygame.sprite.Sprite.__init__(self)
@@ -395,165 +1019,967 @@ class BossHealth(pygame.sprite.Sprite):
         self.image = pygame.Surface((SCREEN_WIDTH - self.width, self.height))
         self.rect = pygame.Rect(SCREEN_WIDTH - self.width, 0, self.width, self.height)
         self.hp_bar = pygame.Surface((500, self.height-10))
-        self.icon = pygame.image.load('Sprites/Monsters/enemy.png')
-        self.icon = rescaleSprite(self.icon, self.height / SCREEN_HEIGHT)
-    def update(self, hp):
+        self.hp_bar.fill((0, 255, 0))
+        self.icon = loadSprite('Sprites/Monsters/enemy.png', self.height / SCREEN_HEIGHT)
+        self.hp = None
+    def update(self, hp, max_hp = BOSS_HP):
+        if hp == self.hp:
+            return False
+        self.hp = hp
         self.image.fill((0, 0, 0))
         self.image.blit(self.icon, [self.width - self.icon.get_width(), 0])
-        boss_hp_width = hp*500/1000 if hp > 0 else 0
-        self.hp_bar = pygame.Surface((boss_hp_width, self.height-10))
-        self.hp_bar.fill((0, 255, 0))
-        self.image.blit(self.hp_bar, [500 - boss_hp_width, 5])
+        boss_hp_width = int(hp*500/max_hp) if hp > 0 else 0
+        self.image.blit(self.hp_bar, [500 - boss_hp_width, 5], (0, 0, boss_hp_width, self.height-10))
+        return True
+
+# The only keys Game.step reads, one bit each in a recorded tick.
+INPUT_KEYS = (K_LEFT, K_RIGHT, K_UP, K_DOWN)
+
+# Keys held during one tick, for driving Game.step without a keyboard.
+# Indexed like pygame.key.get_pressed().
+class Inputs:
+    def __init__(self, keys = ()):
+        self.keys = frozenset(keys)
+    def __getitem__(self, key):
+        return key in self.keys
+    @staticmethod
+    def toMask(pressed_keys):
+        mask = 0
+        for bit, key in enumerate(INPUT_KEYS):
+            if pressed_keys[key]:
+                mask |= 1 << bit
+        return mask
+    @staticmethod
+    def fromMask(mask):
+        return _masks[mask]
+
+_masks = [Inputs(key for bit, key in enumerate(INPUT_KEYS) if mask >> bit & 1) for mask in range(1 << len(INPUT_KEYS))]
+
+# A session is its seed and tick rate (animation time, and with it the
+# power-up bob and pickups, advances by the tick) plus one input byte per
+# tick: replaying the bytes into a Game built with the same seed and rate
+# reproduces the run exactly. A session played on a level file also keeps
+# the level's width and spawn count, so it is not replayed on another.
+class Recording:
+    MAGIC = b'AAIR'
+    VERSION = 3
+    HEADER = struct.Struct('<4sHQIBIII') # magic, version, seed, sim_rate, played on a level, its width and spawns, ticks
+    def __init__(self, seed, masks = b'', sim_rate = SIM_RATE, level = None):
+        self.seed = seed
+        self.sim_rate = sim_rate
+        self.level = (level.width, level.counts[1]) if level else None
+        self.masks = bytearray(masks)
+    def record(self, pressed_keys):
+        self.masks.append(Inputs.toMask(pressed_keys))
+    def inputs(self):
+        for mask in self.masks:
+            yield _masks[mask]
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, self.sim_rate, self.level is not None, *(self.level or (0, 0)), len(self.masks)))
+            f.write(zlib.compress(bytes(self.masks), 9))
+    @classmethod
+    def load(cls, path, level = None):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f'{path} is truncated')
+        magic, version, seed, sim_rate, on_level, width, spawns, ticks = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f'{path} is not a version {cls.VERSION} recording')
+        if on_level != (level is not None) or (level and (level.width, level.counts[1]) != (width, spawns)):
+            raise ValueError(f'{path} was recorded ' + ('on a different level' if on_level else 'on a random level'))
+        try:
+            masks = zlib.decompress(data[cls.HEADER.size:])
+        except zlib.error:
+            raise ValueError(f'{path} is truncated') from None
+        if len(masks) != ticks:
+            raise ValueError(f'{path} is truncated')
+        return cls(seed, masks, sim_rate, level)
+
+# The random layout of chunk i: ladders as (x, y, width, height) and
+# enemies as (x, y). Each chunk has its own RNG, so a chunk comes out the
+# same on every visit and does not depend on which were built before it.
+def generateChunk(seed, i, chunk_width, num_chunks, num_enemy, num_ladders, max_width):
+    rng = random.Random('%d/%d' % (seed, i))
+    left = i * chunk_width
+    ladders = []
+    for j in range(num_ladders): # ladders per screen, cycling through the rows
+        h_ratio = LADDER_ROWS[j % len(LADDER_ROWS)]
+        ladders.append((rng.randint(left, left+SCREEN_WIDTH //2), int(h_ratio*SCREEN_HEIGHT), rng.randint(SCREEN_WIDTH //4, SCREEN_WIDTH //2 - 50), 20))
+    # num_enemy spread evenly over the chunks
+    count = num_enemy * (i + 1) // num_chunks - num_enemy * i // num_chunks
+    right = min(left + chunk_width - 1, max_width)
+    enemies = [(rng.randint(left, right), rng.randint(0, SCREEN_HEIGHT)) for k in range(count)]
+    return ladders, enemies
+
+def newSeed():
+    return random.randrange(1 << 32)
+
 class Game:
-    def __init__(self, screen):
-        self.screen = screen
-        self.player = Player((0, 0))
-        self.coin_score = Score('Sprites/Items/coin1.png', 4*0.09*SCREEN_HEIGHT, 0.09*SCREEN_HEIGHT, (0, 0.1*SCREEN_HEIGHT))
-        self.p_bullets = pygame.sprite.Group()
-        self.e_bullets = pygame.sprite.Group()
+    def __init__(self, seed = None, num_enemy = NUM_ENEMY, max_width = MAX_WIDTH, ladders = len(LADDER_ROWS), sim_rate = SIM_RATE, active_margin = ACTIVE_MARGIN,
+                 p_bullet_delay = P_BULLET_DELAY, e_bullet_delay = E_BULLET_DELAY, max_bullets = MAX_BULLETS, boss_hp = BOSS_HP, level = None):
+        self.seed = newSeed() if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.bodies = Bodies()
+        self.swarm = Swarm(np.random.default_rng(self.seed))
+        self.player = Player((0, 0), p_bullet_delay, max_bullets, self.bodies)
+        self.coins = 0
+        self.bullets = Bullets()
+        self.coin_pool = Pool(Coin)
+        self.powerup_pool = Pool(AddBullet)
+        # A designed level replaces the random layout and sets the width and enemy count.
+        self.level = level
+        if level:
+            max_width = level.width
+            num_enemy = level.counts[1]
         self.enemies = pygame.sprite.Group()
         self.ladders = pygame.sprite.Group()
         self.items = pygame.sprite.Group()
-        self.num_enemy = NUM_ENEMY
-        self.all_sprites = pygame.sprite.Group()
+        self.num_enemy = num_enemy
+        self.num_ladders = ladders
+        self.e_bullet_delay = e_bullet_delay
+        self.max_width = max_width
+        self.camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT, max_width)
+        # None ticks every enemy every tick
+        self.active_margin = active_margin
+        self.activity = ActivityGrid()
         self.left_boundary = Boundary((-10, 0), 20, SCREEN_HEIGHT)
-        self.right_boundary = Boundary((MAX_WIDTH-10, 0), 20, SCREEN_HEIGHT)
-
-        self.all_sprites.add(self.left_boundary)
-        self.all_sprites.add(self.right_boundary)
-        self.p_health = PlayerHealth()
-        self.b_health = BossHealth()
-        for i in range(self.num_enemy):
-            enemy = Enemy((random.randint(0, MAX_WIDTH), random.randint(0, SCREEN_HEIGHT)))
-            self.enemies.add(enemy)
-            self.all_sprites.add(enemy)
-        for i in range(0, MAX_WIDTH, SCREEN_WIDTH):
-            for h_ratio in [0.25, 0.5, 0.75]:
-                ladder = Ladder((random.randint(i, i+SCREEN_WIDTH //2), h_ratio*SCREEN_HEIGHT), random.randint(SCREEN_WIDTH //4, SCREEN_WIDTH //2 - 50), 20, (255, 0, 0))
-                self.ladders.add(ladder)
-                self.all_sprites.add(ladder)
+        self.right_boundary = Boundary((max_width-10, 0), 20, SCREEN_HEIGHT)
+        self.platforms = PlatformIndex()
+        self.bodies.platforms = self.platforms
+        # Streamed level: see stream().
+        self.chunk_width = level.bucket if level else CHUNK_WIDTH
+        self.num_chunks = -(-max_width // self.chunk_width)
+        self.chunks = {} # loaded chunk -> its ladders
+        self.placed = {} # (pos, width, height, color) -> its Ladder, shared by every loaded chunk it reaches into
+        self.geometry = 0 # bumped whenever ladders are added or removed (see StaticLayer)
+        self.visited = set()
+        self.saved = {} # unloaded chunk -> (packed enemies, packed items)
+        self.remaining = num_enemy # enemies left in the whole level, loaded or not
+        self.clock = AnimationClock()
+        self.ticks = 0
+        self.sim_rate = sim_rate
+        self.tick_ms = 1000 / sim_rate
+        # Set by a renderer that draws between ticks: remember where sprites were before each tick.
+        self.interpolate = False
+        self.boss_hp = boss_hp
         self.isBossAppeared = False
         self.isPaused = False
+        self.pauseToggled = False
         self.gameOver = False
         self.victory = False
-    def update(self, pressed_keys):
+        # Optional phase timer (see bench.py): mark(phase) is called after each phase of a tick.
+        self.timer = None
+        self.stream()
+    def step(self, pressed_keys):
+        timer = self.timer
 
         ## Pause game
-        if pressed_keys[K_DOWN]:
+        self.pauseToggled = bool(pressed_keys[K_DOWN])
+        if self.pauseToggled:
             self.isPaused = not self.isPaused
-            font = pygame.font.SysFont("Arial", 50)
-            textSurf = font.render('      PAUSED\n\nPress DOWN to continue', 2, (255,255,255))
-            self.screen.blit(textSurf, [500, 250])
         if self.isPaused:
             return None, 0
+        self.ticks += 1
+        self.stream()
+        if timer: timer.mark('stream')
+        active = self.wakeEnemies()
+        if self.interpolate:
+            self.remember(active)
 
         ## Player & Enemy fire
-        p_bullet = self.player.fire()
-        if p_bullet:
-            self.p_bullets.add(p_bullet)
-            self.all_sprites.add(p_bullet)
-        for enemy in self.enemies.sprites():
-            e_bullet = enemy.fire()
-            if e_bullet:
-                self.e_bullets.add(e_bullet)
-                self.all_sprites.add(e_bullet)
-        self.enemies.update(player_rect = self.player.rect)
+        self.player.fire(self.bullets)
+        self.swarm.fire(active, self.bullets)
+        if timer: timer.mark('fire')
+        player_rect = self.player.rect
+        self.bodies.step(active, self.swarm.think(player_rect))
+        if timer: timer.mark('ai')
 
         ## Va cham
-        enemy_collide = pygame.sprite.groupcollide(self.enemies,self.p_bullets,False, True) # enemy vs player_bullet
-        enemy_falls = pygame.sprite.groupcollide(self.enemies,self.ladders,False, False) # enemy vs ladder
-        player_collide = pygame.sprite.spritecollide(self.player,self.ladders,False) # player vs ladder
-        player_bullet = pygame.sprite.spritecollide(self.player,self.e_bullets,False) # player vs enemy_bullet
+        view = self.camera.view
+        targets = [enemy for enemy in active if view.colliderect(enemy.rect)] # bullets never leave the view
+        hit, damage = self.bullets.collide([tuple(enemy.rect) for enemy in targets], PLAYER) # enemy vs player_bullet
+        hit, first = np.unique(hit, return_index = True) # an enemy takes the first bullet that hit it
+        enemy_collide = [(targets[i], d) for i, d in zip(hit.tolist(), damage[first].tolist())]
+        enemy_falls = self.platforms.groupcollide(active, False, False) # enemy vs ladder
+        player_collide = self.platforms.spritecollide(self.player, False) # player vs ladder
+        player_bullet = self.bullets.collide([tuple(self.player.rect)], ENEMY)[1] # player vs enemy_bullet
+        if timer: timer.mark('collision')
 
-        self.player.update(pressed_keys)
+        self.player.update(pressed_keys, self.camera.view)
+        if timer: timer.mark('player')
 
-        
-        if len(self.enemies.sprites()) == 0 and not self.isBossAppeared: # Tao boss
+        if self.remaining == 0 and not self.isBossAppeared: # Tao boss
             self.isBossAppeared = True
-            self.boss = Boss((SCREEN_WIDTH - 100, 0))
-            self.all_sprites.add(self.boss)
+            self.boss = Boss((self.camera.x + SCREEN_WIDTH - 100, 0), self.rng, self.boss_hp, self.bodies)
         if self.isBossAppeared: # Xu ly boss
             self.boss.update(player_rect = self.player.rect)
-            e_bullet = self.boss.fire()
-            if e_bullet:
-                self.e_bullets.add(e_bullet)
-                self.all_sprites.add(e_bullet)
-            boss_hurted = pygame.sprite.spritecollide(self.boss,self.p_bullets,False)
-            if boss_hurted:
-                for bullet in boss_hurted:
-                    self.victory = self.boss.hurted(bullet.damage)
-                    bullet.kill()
-            self.b_health.update(self.boss.hp)
+            self.boss.fire(self.bullets)
+            boss_hurted = self.bullets.collide([tuple(self.boss.rect)], PLAYER)[1]
+            for damage in boss_hurted.tolist():
+                self.victory = self.boss.hurted(damage)
+            if timer: timer.mark('boss')
 
         # Xu ly va cham
-        if player_bullet: # player vs enemy_bullet
-            for bullet in player_bullet:
-                self.gameOver = self.player.hurted(bullet.damage)
-                bullet.kill()
+        for damage in player_bullet.tolist(): # player vs enemy_bullet
+            self.gameOver = self.player.hurted(damage)
         if player_collide: # player vs ladder
             for lad in player_collide:
                 self.player.fall(lad)
         if enemy_falls:  # enemy vs ladder
             for res in enemy_falls:
                 res.fall(enemy_falls[res][0])
-        if self.player.rect.left > SCREEN_WIDTH // 2 and self.right_boundary.rect.left + 10 > (SCREEN_WIDTH): # chuyen canh khi player di sang phai
-            dx = self.player.rect.left - (SCREEN_WIDTH // 2)
-            for sprite in self.all_sprites.sprites():
-                sprite.trans_screen(dx)
-            self.player.rect.left = SCREEN_WIDTH // 2
-        elif self.player.rect.left < 10 and self.left_boundary.rect.left+10 < 0: # chuyen canh khi player di sang trai
-            dx = self.player.rect.left - 10
-            for sprite in self.all_sprites.sprites():
-                sprite.trans_screen(dx)
-            self.player.rect.left = 10
-        if enemy_collide: # enemy vs player_bullet
-            for res in enemy_collide:
-                item = res.hurted(enemy_collide[res][0].damage)
-                if item:
-                    self.items.add(item)
-                    self.all_sprites.add(item)
+        for enemy in active:
+            self.activity.move(enemy)
+        if timer: timer.mark('collision')
+        self.camera.follow(self.player.rect)
+        if timer: timer.mark('scroll')
+        for res, damage in enemy_collide: # enemy vs player_bullet
+            item = res.hurted(damage, self.coin_pool.acquire, self.powerup_pool.acquire)
+            if item:
+                self.items.add(item)
+            if not res.alive():
+                self.activity.remove(res)
+                self.remaining -= 1
         
         pitem_collide = pygame.sprite.spritecollide(self.player,self.items,False) # player vs item
         if pitem_collide:
             for item in pitem_collide:
-                self.coin_score.score += item.score
+                self.coins += item.score
                 self.player.upgrade(item.addbullet)
                 item.kill()
+        if timer: timer.mark('collision')
         #### Update
-        self.p_bullets.update()
-        self.e_bullets.update()
-        self.items.update()
-        self.p_health.update(self.player.hp)
-        self.coin_score.update()
-        self.screen.fill((0, 0, 0))
-
-
-        self.screen.blit(self.left_boundary.image, self.left_boundary.rect)
-        self.screen.blit(self.right_boundary.image, self.right_boundary.rect)
-        self.screen.blit(self.coin_score.image, self.coin_score.rect)
-        self.screen.blit(self.p_health.image, self.p_health.rect)
-        self.ladders.draw(screen)
-        if self.isBossAppeared:
-            self.screen.blit(self.b_health.image, self.b_health.rect)
-            self.screen.blit(self.boss.image, self.boss.rect)
-        screen.blit(self.player.image, self.player.rect)
-        self.items.draw(self.screen)
-        self.p_bullets.draw(self.screen)
-        self.e_bullets.draw(self.screen)
-        self.enemies.draw(self.screen)
-        score = self.coin_score.score * 20 + max(self.player.hp, 0) + 100
+        self.bullets.update(self.camera.view)
+        self.clock.tick(self.tick_ms)
+        self.items.update(self.clock.time)
+        if timer: timer.mark('update')
+        score = self.score()
         if self.victory:
             return score, 1
         if self.gameOver:
             return score, -1
         return None, 0
+    # 20 a coin, plus what health the player has left, plus 100.
+    def score(self):
+        return self.coins * 20 + max(self.player.hp, 0) + 100
+    # The level is built a screen-wide chunk at a time. Chunks within
+    # LOAD_MARGIN of the view are loaded; chunks further than EVICT_MARGIN
+    # are unloaded, so only a few screens are ever live however long the
+    # level is.
+    def stream(self):
+        view = self.camera.view
+        first = max(0, (view.left - LOAD_MARGIN) // self.chunk_width)
+        last = min(self.num_chunks - 1, (view.right + LOAD_MARGIN - 1) // self.chunk_width)
+        for i in range(first, last + 1):
+            if i not in self.chunks:
+                self.loadChunk(i)
+        first = (view.left - EVICT_MARGIN) // self.chunk_width
+        last = (view.right + EVICT_MARGIN - 1) // self.chunk_width
+        far = [i for i in self.chunks if i < first or i > last]
+        if far:
+            for i in far:
+                self.unloadLadders(i)
+            self.evict()
+    def chunkOf(self, x):
+        return min(max(x // self.chunk_width, 0), self.num_chunks - 1)
+    # Chunk i's platforms as (pos, width, height, color), and for a random
+    # level its enemy spawns.
+    def layout(self, i):
+        if self.level:
+            return [((x, y), w, h, color) for x, y, w, h, *color in self.level.platforms(i)], None
+        platforms, spawns = generateChunk(self.seed, i, self.chunk_width, self.num_chunks, self.num_enemy, self.num_ladders, self.max_width)
+        return [((x, y), w, h, (255, 0, 0)) for x, y, w, h in platforms], spawns
+    # A platform wider than its chunk is listed by every chunk it reaches
+    # into (see level.py); it stays up while any of them is loaded.
+    def loadLadders(self, i, platforms):
+        ladders = []
+        for pos, w, h, color in platforms:
+            key = (tuple(pos), w, h, tuple(color))
+            ladder = self.placed.get(key)
+            if ladder is None:
+                ladder = Ladder(pos, w, h, tuple(color))
+                ladder.key = key
+                ladder.held = 0
+                self.placed[key] = ladder
+                self.ladders.add(ladder)
+                self.platforms.add(ladder)
+            ladder.held += 1
+            ladders.append(ladder)
+        self.chunks[i] = ladders
+        self.geometry += 1
+    def unloadLadders(self, i):
+        for ladder in self.chunks.pop(i):
+            ladder.held -= 1
+            if not ladder.held:
+                del self.placed[ladder.key]
+                self.platforms.remove(ladder)
+                ladder.kill()
+        self.geometry += 1
+    # Ladders are built on every visit; enemies and items from the layout
+    # only on the first, after that they come back from what evict() saved.
+    def loadChunk(self, i):
+        platforms, spawns = self.layout(i)
+        self.loadLadders(i, platforms)
+        if i not in self.visited:
+            self.visited.add(i)
+            if self.level:
+                for x, y, kind, hp in self.level.spawns(i):
+                    enemy = Enemy((x, y), self.rng, self.e_bullet_delay, self.bodies, self.swarm)
+                    if hp:
+                        enemy.hp = hp
+                    self.spawn(enemy)
+                for x, y, kind in self.level.items(i):
+                    pool = self.coin_pool if kind == COIN else self.powerup_pool
+                    self.items.add(pool.acquire((x, y)))
+            else:
+                for pos in spawns:
+                    self.spawn(Enemy(pos, self.rng, self.e_bullet_delay, self.bodies, self.swarm))
+        enemies, items = self.saved.pop(i, (b'', b''))
+        for record in ENEMY_RECORD.iter_unpack(enemies):
+            enemy = Enemy((0, 0), self.rng, self.e_bullet_delay, self.bodies, self.swarm)
+            enemy.unpack(record)
+            self.spawn(enemy)
+        for kind, x, y in ITEM_RECORD.iter_unpack(items):
+            pool = self.coin_pool if kind == COIN else self.powerup_pool
+            self.items.add(pool.acquire((x, y)))
+    def spawn(self, enemy):
+        self.enemies.add(enemy)
+        self.activity.add(enemy)
+    # Packs away enemies and items that are no longer in a loaded chunk,
+    # into the chunk they are in now.
+    def evict(self):
+        saved = self.saved
+        for enemy in self.enemies.sprites():
+            i = self.chunkOf(enemy.rect.centerx)
+            if i not in self.chunks:
+                enemies, items = saved.get(i, (b'', b''))
+                saved[i] = enemies + enemy.pack(), items
+                self.activity.remove(enemy)
+                enemy.kill()
+        for item in self.items.sprites():
+            i = self.chunkOf(item.rect.centerx)
+            if i not in self.chunks:
+                kind = COIN if isinstance(item, Coin) else POWERUP
+                enemies, items = saved.get(i, (b'', b''))
+                saved[i] = enemies, items + ITEM_RECORD.pack(kind, item.rect.x, getattr(item, 'top', item.rect.y))
+                item.kill()
+    # Kills every enemy in the level, loaded or not.
+    def clearEnemies(self):
+        for enemy in self.enemies.sprites():
+            self.activity.remove(enemy)
+            enemy.kill()
+        self.visited.update(range(self.num_chunks))
+        self.saved = {i: (b'', items) for i, (enemies, items) in self.saved.items()}
+        self.remaining = 0
+    # Enemies within active_margin of the view, in spawn order. Enemies
+    # coming back into range catch up on the ticks they slept through.
+    def wakeEnemies(self):
+        if self.active_margin is None:
+            active = self.enemies.sprites()
+        else:
+            view = self.camera.view
+            active = self.activity.query(view.left - self.active_margin, view.right + self.active_margin)
+        tick = self.ticks
+        for enemy in active:
+            if enemy.lastTick is not None and enemy.lastTick < tick - 1:
+                enemy.catchUp(tick - 1 - enemy.lastTick)
+            enemy.lastTick = tick
+        return active
+    def remember(self, active):
+        self.camera.prev_x = self.camera.x
+        self.player.prev = self.player.rect.topleft
+        if self.isBossAppeared:
+            self.boss.prev = self.boss.rect.topleft
+        for sprites in (active, self.items):
+            for sprite in sprites:
+                sprite.prev = sprite.rect.topleft
+    # Everything step() reads or changes, as bytes (see SNAPSHOT). Ladders
+    # are left out: restore() rebuilds them from the layout.
+    def snapshot(self):
+        player, bodies = self.player, self.bodies
+        flags = self.isBossAppeared | self.isPaused << 1 | self.pauseToggled << 2 | self.gameOver << 3 | self.victory << 4
+        y, pvy, plimit, jumping, falling = bodies.state(player.slot)
+        fields = [self.ticks, self.coins, self.remaining, self.camera.x, self.clock.time, flags,
+                  player.rect.x, player.rect.y, player.hp, player.bulletCounter, player.direct[0], player.num_bullets, pvy, plimit, jumping | falling << 1]
+        if self.isBossAppeared:
+            boss = self.boss
+            if boss.slot is None: # killed
+                fields[5] |= 1 << 5
+                bvy = blimit = jumping = falling = 0
+            else:
+                y, bvy, blimit, jumping, falling = bodies.state(boss.slot)
+            fields += [boss.rect.x, boss.rect.y, boss.hp, boss.max_hp, boss.bulletCounter, boss.direct[0], boss.isLeft, bvy, blimit, jumping | falling << 1]
+        else:
+            fields += [0] * 10
+        enemies = self.enemies.sprites()
+        items = self.items.sprites()
+        n = self.bullets.count
+        fields += [len(enemies), len(items), n, len(self.chunks), len(self.visited), len(self.saved)]
+        parts = [SNAPSHOT.pack(*fields)]
+        version, words, gauss = self.rng.getstate()
+        parts.append(RANDOM_STATE.pack(*words, gauss is not None, gauss or 0))
+        pcg = self.swarm.rng.bit_generator.state
+        parts.append(PCG_STATE.pack(pcg['state']['state'].to_bytes(16, 'little'), pcg['state']['inc'].to_bytes(16, 'little'),
+                                    pcg['has_uint32'], pcg['uinteger']))
+        parts += [enemy.pack() for enemy in enemies]
+        parts += [SNAPSHOT_ITEM.pack(COIN if isinstance(item, Coin) else POWERUP, item.rect.x, item.rect.y, getattr(item, 'top', item.rect.y),
+                                     -1 if item.born is None else item.born) for item in items]
+        bullets = self.bullets
+        parts += [a[:n].tobytes() for a in (bullets.pos, bullets.prev, bullets.vel, bullets.damage, bullets.owner)]
+        parts.append(struct.pack('<%di' % len(self.chunks), *self.chunks))
+        parts.append(struct.pack('<%di' % len(self.visited), *self.visited))
+        for i, (enemies, items) in self.saved.items():
+            parts += [SAVED_CHUNK.pack(i, len(enemies), len(items)), enemies, items]
+        return b''.join(parts)
+    # Puts the game back as it was at snapshot(). Live enemies and pooled
+    # items are reused rather than built again.
+    def restore(self, data):
+        player, bodies = self.player, self.bodies
+        (self.ticks, self.coins, self.remaining, x, self.clock.time, flags,
+         player.rect.x, player.rect.y, player.hp, player.bulletCounter, direct, player.num_bullets, vy, limit, body,
+         bx, by, bhp, bmax_hp, bcounter, bdirect, bleft, bvy, blimit, bbody,
+         num_enemies, num_items, num_bullets, num_chunks, num_visited, num_saved) = SNAPSHOT.unpack_from(data)
+        offset = SNAPSHOT.size
+        self.camera.x = self.camera.prev_x = self.camera.view.x = x
+        player.direct = (direct, 0)
+        player.prev = None
+        bodies.restore(player.slot, player.rect.y, vy, limit, bool(body & 1), bool(body & 2))
+        if flags & 1:
+            if not self.isBossAppeared or self.boss.slot is None: # none yet, or killed
+                self.boss = Boss((bx, by), self.rng, bmax_hp, bodies)
+            boss = self.boss
+            boss.rect.topleft = bx, by
+            boss.hp, boss.max_hp, boss.bulletCounter, boss.direct, boss.isLeft = bhp, bmax_hp, bcounter, (bdirect, 0), bool(bleft)
+            boss.image = boss.left_image if boss.isLeft else boss.right_image
+            boss.prev = None
+            if flags & 1 << 5:
+                boss.kill()
+            else:
+                bodies.restore(boss.slot, by, bvy, blimit, bool(bbody & 1), bool(bbody & 2))
+        elif self.isBossAppeared:
+            self.boss.kill()
+            del self.boss
+        self.isBossAppeared, self.isPaused, self.pauseToggled, self.gameOver, self.victory = (bool(flags >> bit & 1) for bit in range(5))
+
+        words = RANDOM_STATE.unpack_from(data, offset)
+        offset += RANDOM_STATE.size
+        self.rng.setstate((3, words[:625], words[626] if words[625] else None))
+        state, inc, has_uint32, uinteger = PCG_STATE.unpack_from(data, offset)
+        offset += PCG_STATE.size
+        self.swarm.rng.bit_generator.state = {'bit_generator': 'PCG64', 'has_uint32': has_uint32, 'uinteger': uinteger,
+                                              'state': {'state': int.from_bytes(state, 'little'), 'inc': int.from_bytes(inc, 'little')}}
+
+        end = offset + num_enemies * ENEMY_RECORD.size
+        old = self.enemies.sprites()
+        self.enemies.empty()
+        self.activity = ActivityGrid()
+        for k, record in enumerate(ENEMY_RECORD.iter_unpack(data[offset:end])):
+            enemy = old[k] if k < len(old) else Enemy((0, 0), self.rng, self.e_bullet_delay, bodies, self.swarm)
+            enemy.unpack(record)
+            enemy.prev = None
+            self.spawn(enemy)
+        for enemy in old[num_enemies:]:
+            enemy.kill()
+        offset = end
+
+        for item in self.items.sprites():
+            item.kill()
+        end = offset + num_items * SNAPSHOT_ITEM.size
+        for kind, x, y, top, born in SNAPSHOT_ITEM.iter_unpack(data[offset:end]):
+            item = (self.coin_pool if kind == COIN else self.powerup_pool).acquire((x, top))
+            item.rect.y = y
+            if born >= 0:
+                item.born = born
+                item.update(self.clock.time)
+            self.items.add(item)
+        offset = end
+
+        bullets = self.bullets
+        bullets.reserve(num_bullets)
+        for a in (bullets.pos, bullets.prev, bullets.vel, bullets.damage, bullets.owner):
+            size = a[:num_bullets].nbytes
+            a[:num_bullets] = np.frombuffer(data, a.dtype, size // a.itemsize, offset).reshape(a[:num_bullets].shape)
+            offset += size
+        bullets.count = num_bullets
+
+        chunks = list(struct.unpack_from('<%di' % num_chunks, data, offset))
+        offset += 4 * num_chunks
+        # Platform queries break ties by load order, so rebuild the ladders
+        # in the snapshot's order unless they already are in it.
+        if list(self.chunks) != chunks:
+            for i in list(self.chunks):
+                self.unloadLadders(i)
+            for i in chunks:
+                self.loadLadders(i, self.layout(i)[0])
+        self.visited = set(struct.unpack_from('<%di' % num_visited, data, offset))
+        offset += 4 * num_visited
+        self.saved = {}
+        for k in range(num_saved):
+            i, enemies, items = SAVED_CHUNK.unpack_from(data, offset)
+            offset += SAVED_CHUNK.size
+            self.saved[i] = data[offset:offset + enemies], data[offset + enemies:offset + enemies + items]
+            offset += enemies + items
+    def poolStats(self):
+        return {'bullets': self.bullets.stats(), 'coins': self.coin_pool.stats(), 'powerups': self.powerup_pool.stats()}
+
+# The last `size` snapshots, newest last, for rewinding. Each is kept
+# with a mark: where the caller was in anything that has to rewind with
+# the game, such as a recording. Memory is bounded by size snapshots;
+# stats() reports what is held.
+class History:
+    def __init__(self, size):
+        self.snapshots = collections.deque(maxlen = size)
+        self.bytes = 0
+    def __len__(self):
+        return len(self.snapshots)
+    def clear(self):
+        self.snapshots.clear()
+        self.bytes = 0
+    def push(self, data, mark = None):
+        if len(self.snapshots) == self.snapshots.maxlen:
+            self.bytes -= len(self.snapshots[0][0])
+        self.snapshots.append((data, mark))
+        self.bytes += len(data)
+    # (snapshot, mark) of the newest snapshot, which is dropped.
+    def pop(self):
+        data, mark = self.snapshots.pop()
+        self.bytes -= len(data)
+        return data, mark
+    def stats(self):
+        return {'snapshots': len(self.snapshots), 'size': self.snapshots.maxlen, 'bytes': self.bytes}
+
+# A snapshot on disk, with the Game settings that rebuild the level around
+# it: what --autosave writes and --resume loads. A game saved on a level
+# file has to be resumed with the same level.
+class SaveFile:
+    MAGIC = b'AASV'
+    VERSION = 1
+    # seed, num_enemy, max_width, ladders, active_margin (-1: None), sim_rate,
+    # p_bullet_delay, e_bullet_delay, max_bullets, boss_hp, played on a level
+    HEADER = struct.Struct('<4sHxxQIIIiIIIIIB')
+    @classmethod
+    def save(cls, path, game):
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, game.seed, game.num_enemy, game.max_width, game.num_ladders,
+                                 -1 if game.active_margin is None else game.active_margin, game.sim_rate, game.player.bullet_delay,
+                                 game.e_bullet_delay, game.player.max_bullets, game.boss_hp, game.level is not None)
+        # written aside and moved into place, so a crash never leaves half a save
+        with open(path + '.tmp', 'wb') as f:
+            f.write(header)
+            f.write(zlib.compress(game.snapshot()))
+        os.replace(path + '.tmp', path)
+    @classmethod
+    def load(cls, path, level = None):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f'{path} is not a saved game')
+        (magic, version, seed, num_enemy, max_width, ladders, active_margin, sim_rate,
+         p_bullet_delay, e_bullet_delay, max_bullets, boss_hp, on_level) = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f'{path} is not a version {cls.VERSION} saved game')
+        if on_level != (level is not None) or (level and (level.width, level.counts[1]) != (max_width, num_enemy)):
+            raise ValueError(f'{path} was saved ' + ('on a different level' if on_level else 'on a random level'))
+        try:
+            data = zlib.decompress(data[cls.HEADER.size:])
+        except zlib.error:
+            raise ValueError(f'{path} is truncated') from None
+        game = Game(seed, num_enemy, max_width, ladders, sim_rate, None if active_margin < 0 else active_margin,
+                    p_bullet_delay, e_bullet_delay, max_bullets, boss_hp, level)
+        game.restore(data)
+        return game
+
+# Where each frame's time went. Phases are summed over the frame (a frame
+# can run several ticks) into a fixed ring of the last `size` frames,
+# next to the entity counts at the end of the frame. Game and Renderer
+# call mark(phase) when they are given the profiler as their timer.
+PHASES = ('events', 'stream', 'fire', 'ai', 'collision', 'player', 'boss', 'scroll', 'update', 'hud', 'draw', 'present', 'wait')
+COUNTS = ('bullets', 'enemies', 'items', 'drawn', 'culled')
+
+class Profiler:
+    def __init__(self, size = 300):
+        self.size = size
+        self.columns = {phase: i for i, phase in enumerate(PHASES)}
+        self.starts = np.zeros(size)
+        self.times = np.zeros((size, len(PHASES)))
+        self.counts = np.zeros((size, len(COUNTS)), dtype = np.int32)
+        self.index = 0
+        self.frames = 0
+        self.origin = time.perf_counter()
+        self.last = self.origin
+        # Seconds from START to the first frame on screen, and from starting
+        # a game (New Game, a replay or a resume) to its first frame.
+        self.first_frame = None
+        self.game_start = None
+    def begin(self):
+        self.last = time.perf_counter()
+        self.starts[self.index] = self.last - self.origin
+        self.times[self.index] = 0
+        self.counts[self.index] = 0
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.times[self.index, self.columns[phase]] += now - self.last
+        self.last = now
+    def end(self, game = None, renderer = None):
+        if game:
+            self.counts[self.index] = game.bullets.count, len(game.enemies), len(game.items), *(renderer.frame if renderer else (0, 0))
+        self.index = (self.index + 1) % self.size
+        self.frames += 1
+    # Recorded frames, oldest first.
+    def order(self):
+        if self.frames < self.size:
+            return np.arange(self.frames)
+        return (np.arange(self.size) + self.index) % self.size
+    def frameTimes(self):
+        return self.times[self.order()].sum(axis = 1)
+    def fps(self):
+        total = self.frameTimes().sum()
+        return len(self.frameTimes()) / total if total else 0
+    # (phase, mean seconds per frame), slowest first; waiting on the frame cap is left out.
+    def top(self, n = 5):
+        means = self.times[self.order()].mean(axis = 0) if self.frames else np.zeros(len(PHASES))
+        ranked = sorted(((phase, means[i]) for phase, i in self.columns.items() if phase != 'wait'), key = lambda pair: -pair[1])
+        return ranked[:n]
+    def report(self):
+        order = self.order()
+        return {
+            'first_frame_ms': None if self.first_frame is None else round(self.first_frame * 1000, 1),
+            'game_start_ms': None if self.game_start is None else round(self.game_start * 1000, 1),
+            'phases': list(PHASES),
+            'counts': list(COUNTS),
+            'frames': [{
+                'start': round(float(self.starts[i]), 6),
+                'phases': {phase: round(float(t), 6) for phase, t in zip(PHASES, self.times[i]) if t},
+                'counts': dict(zip(COUNTS, self.counts[i].tolist())),
+            } for i in order.tolist()],
+        }
+    # Chrome trace (chrome://tracing, Perfetto). Phase times are sums, so
+    # within a frame they are laid end to end in PHASES order.
+    def trace(self):
+        events = []
+        for i in self.order().tolist():
+            ts = self.starts[i] * 1e6
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': round(ts, 1), 'dur': round(self.times[i].sum() * 1e6, 1)})
+            for phase, t in zip(PHASES, self.times[i].tolist()):
+                if t:
+                    events.append({'name': phase, 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': round(ts, 1), 'dur': round(t * 1e6, 1)})
+                    ts += t * 1e6
+            events.append({'name': 'entities', 'ph': 'C', 'pid': 1, 'ts': round(self.starts[i] * 1e6, 1), 'args': dict(zip(COUNTS, self.counts[i].tolist()))})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f)
+    def saveTrace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+# FPS, a frame-time graph over the profiler's ring, the slowest phases
+# and, given a History, how much rewind it holds. Toggled with F3.
+class ProfileOverlay:
+    def __init__(self, profiler, fps = FPS, history = None):
+        self.profiler = profiler
+        self.history = history
+        self.budget = 1000 / fps
+        self.graph_h = 60
+        self.image = pygame.Surface((profiler.size + 10, self.graph_h + 190))
+        self.image.set_alpha(200)
+        self.rect = self.image.get_rect(bottomleft = (0, SCREEN_HEIGHT))
+        self.visible = False
+    def toggle(self):
+        self.visible = not self.visible
+    def draw(self, screen):
+        profiler = self.profiler
+        self.image.fill((0, 0, 0))
+        lines = ['%.1f fps' % profiler.fps()]
+        lines += ['%-9s %6.2f ms' % (phase, t * 1000) for phase, t in profiler.top()]
+        if profiler.first_frame is not None:
+            lines.append('first frame %.0f ms' % (profiler.first_frame * 1000) +
+                         (', game start %.0f ms' % (profiler.game_start * 1000) if profiler.game_start is not None else ''))
+        if profiler.frames:
+            drawn, culled = profiler.counts[(profiler.index - 1) % profiler.size, 3:].tolist()
+            lines.append('sprites %d drawn %d culled' % (drawn, culled))
+        if self.history is not None:
+            stats = self.history.stats()
+            lines.append('rewind %d/%d ticks %.0f KB' % (stats['snapshots'], stats['size'], stats['bytes'] / 1024))
+        y = 2
+        for line in lines:
+            # Numbers change every frame, so these are not worth caching.
+            self.image.blit(getFont('Consolas', 16).render(line, True, (255, 255, 255)), (5, y))
+            y += 18
+        top = self.image.get_height() - self.graph_h - 5
+        scale = self.graph_h / (2 * self.budget) # the budget line sits half way up
+        for x, t in enumerate(profiler.frameTimes().tolist()):
+            h = min(self.graph_h, int(t * 1000 * scale))
+            color = (0, 200, 0) if t * 1000 <= self.budget else (220, 60, 0)
+            pygame.draw.line(self.image, color, (5 + x, top + self.graph_h), (5 + x, top + self.graph_h - h))
+        pygame.draw.line(self.image, (255, 255, 0), (5, top + self.graph_h // 2), (5 + profiler.size, top + self.graph_h // 2))
+        return screen.blit(self.image, self.rect)
+
+# Ladders and boundaries never move, so they are drawn once into tiles
+# TILE_WIDTH wide, and each frame blits the one or two tiles under the
+# view. The tiles are redrawn only after the game's ladders change (a
+# chunk loaded or unloaded, see Game.geometry), so the static level
+# costs the same to draw however many platforms it has. The tiles are
+# RLE colour-keyed on the black background: a fill plus a blit that skips
+# the empty runs is cheaper than copying whole opaque tiles.
+class StaticLayer:
+    def __init__(self, screen, tile_width = TILE_WIDTH):
+        self.screen = screen
+        self.tile_width = tile_width
+        self.tiles = {} # tile -> Surface
+        self.game = None
+        self.geometry = None
+        self.builds = 0
+    # Drops the tiles if they were drawn for another game or other ladders; True if it did.
+    def sync(self, game):
+        if game is self.game and game.geometry == self.geometry:
+            return False
+        self.game = game
+        self.geometry = game.geometry
+        self.tiles = {}
+        return True
+    def tile(self, i):
+        tile = self.tiles.get(i)
+        if tile is None:
+            game = self.game
+            area = pygame.Rect(i * self.tile_width, 0, self.tile_width, self.screen.get_height())
+            tile = pygame.Surface(area.size, 0, self.screen)
+            tile.fill((0, 0, 0))
+            tile.blits([(sprite.image, sprite.rect.move(-area.x, 0)) for sprite in (game.left_boundary, game.right_boundary, *game.ladders)
+                        if area.colliderect(sprite.rect)], False)
+            tile.set_colorkey((0, 0, 0), RLEACCEL)
+            self.tiles[i] = tile
+            self.builds += 1
+        return tile
+    # Blits the static level under the view at cx: the whole screen, or
+    # with rects only those parts of it.
+    def draw(self, cx, rects = None):
+        width = self.tile_width
+        first = cx // width
+        last = (cx + self.screen.get_width() - 1) // width
+        for i in [i for i in self.tiles if i < first - 1 or i > last + 1]: # keep the neighbours for small scrolls
+            del self.tiles[i]
+        if rects is None:
+            self.screen.fill((0, 0, 0))
+        else:
+            for rect in rects:
+                self.screen.fill((0, 0, 0), rect)
+        blits = []
+        for i in range(first, last + 1):
+            tile = self.tile(i)
+            x = i * width - cx
+            if rects is None:
+                blits.append((tile, (x, 0)))
+                continue
+            bounds = tile.get_rect()
+            for rect in rects:
+                area = bounds.clip(rect.move(-x, 0))
+                if area:
+                    blits.append((tile, area.move(x, 0), area))
+        self.screen.blits(blits, False)
+
+# Enemies, items and bullets are culled against the screen and each layer
+# goes out as one blits() call. Only DirtyRenderer needs the rects blits()
+# returns; the others use fblits(), which skips building them (pygame-ce
+# only: under upstream pygame they ask blits() not to build them).
+class Renderer:
+    keeps_rects = False
+    LAYERS = ('items', 'bullets', 'enemies')
+    def __init__(self, screen):
+        self.screen = screen
+        self.static = StaticLayer(screen)
+        self.bounds = screen.get_rect()
+        self.fblits = getattr(screen, 'fblits', None)
+        # Sprites drawn and culled: in the last frame, and per layer over every frame.
+        self.frame = [0, 0]
+        self.layers = {layer: [0, 0] for layer in self.LAYERS}
+        # Optional profiler: mark('hud') and mark('draw') are called in draw().
+        self.timer = None
+        # HUD widgets, built on the first draw(): their sprites are game
+        # sprites, left for preload() while the menu is up.
+        self.coin_score = None
+        self.changed = True
+        self.hud = []
+    # The whole screen was drawn over (menus, game over): show it on the next present().
+    def invalidate(self):
+        self.changed = True
+    def present(self):
+        if self.changed:
+            pygame.display.flip()
+            self.changed = False
+    # alpha is how far the frame is between the previous tick and the
+    # current one; sprites are drawn that far along.
+    def draw(self, game, alpha = 1):
+        if self.coin_score is None:
+            self.coin_score = Score('Sprites/Items/coin1.png', 4*0.09*SCREEN_HEIGHT, 0.09*SCREEN_HEIGHT, (0, 0.1*SCREEN_HEIGHT))
+            self.p_health = PlayerHealth()
+            self.b_health = BossHealth()
+        if game.isPaused:
+            if game.pauseToggled:
+                textSurf = renderText("Arial", 50, '      PAUSED\n\nPress DOWN to continue', 2, (255,255,255))
+                self.mark([self.screen.blit(textSurf, [500, 250])])
+            return
+        self.coin_score.score = game.coins
+        self.hud = [widget.rect for widget, changed in (
+            (self.p_health, self.p_health.update(game.player.hp)),
+            (self.coin_score, self.coin_score.update()),
+            (self.b_health, game.isBossAppeared and self.b_health.update(game.boss.hp, game.boss.max_hp))) if changed]
+        if self.timer: self.timer.mark('hud')
+        self.alpha = alpha if game.interpolate else 1
+        self.cx = game.camera.offset(self.alpha)
+        self.frame = [0, 0]
+        self.clear(game)
+        self.mark(self.drawScene(game))
+        if self.timer: self.timer.mark('draw')
+    def clear(self, game):
+        self.static.sync(game)
+        self.static.draw(self.cx)
+    def mark(self, rects):
+        self.changed = True
+    # Draws everything and returns the screen rects of whatever changed
+    # since the last frame: moving sprites and HUD widgets that redrew.
+    def drawScene(self, game):
+        rects = list(self.hud)
+        self.screen.blit(self.coin_score.image, self.coin_score.rect)
+        self.screen.blit(self.p_health.image, self.p_health.rect)
+        if game.isBossAppeared:
+            self.screen.blit(self.b_health.image, self.b_health.rect)
+            rects.append(self.screen.blit(game.boss.image, self.place(game.boss)))
+        rects.append(self.screen.blit(game.player.image, self.place(game.player)))
+        rects += self.drawGroup('items', game.items)
+        rects += self.drawBullets(game.bullets)
+        # Only enemies near the view are looked at, however many are loaded.
+        enemies = game.activity.query(self.cx - CULL_MARGIN, self.cx + self.bounds.width + CULL_MARGIN)
+        rects += self.drawGroup('enemies', enemies, len(game.enemies) - len(enemies))
+        return rects
+    def place(self, sprite):
+        x, y = sprite.rect.topleft
+        prev = getattr(sprite, 'prev', None)
+        if prev is not None and self.alpha != 1:
+            x = round(prev[0] + (x - prev[0]) * self.alpha)
+            y = round(prev[1] + (y - prev[1]) * self.alpha)
+        return x - self.cx, y
+    def count(self, layer, drawn, culled):
+        self.frame[0] += drawn
+        self.frame[1] += culled
+        counts = self.layers[layer]
+        counts[0] += drawn
+        counts[1] += culled
+    def blits(self, blits):
+        if self.keeps_rects:
+            return self.screen.blits(blits)
+        if self.fblits:
+            self.fblits(blits)
+        else:
+            self.screen.blits(blits, False)
+        return []
+    # culled: sprites already left out before the group was passed in.
+    def drawGroup(self, layer, group, culled = 0):
+        place = self.place
+        bounds = self.bounds
+        blits = []
+        for sprite in group:
+            image = sprite.image
+            x, y = place(sprite)
+            if bounds.colliderect(x, y, image.get_width(), image.get_height()):
+                blits.append((image, (x, y)))
+        self.count(layer, len(blits), culled + len(group) - len(blits))
+        return self.blits(blits)
+    def drawBullets(self, bullets):
+        image = bullets.image
+        n = bullets.count
+        xy = bullets.pos[:n]
+        if self.alpha != 1:
+            xy = bullets.prev[:n] + (xy - bullets.prev[:n]) * self.alpha
+        xy = (np.floor(xy) - (self.cx, 0)).astype(int)
+        w, h = image.get_size()
+        xy = xy[(xy[:, 0] > -w) & (xy[:, 0] < self.bounds.width) & (xy[:, 1] > -h) & (xy[:, 1] < self.bounds.height)]
+        self.count('bullets', len(xy), n - len(xy))
+        return self.blits([(image, pos) for pos in xy.tolist()])
+    # Sprites drawn and culled per layer since the renderer was built.
+    def stats(self):
+        return {layer: {'drawn': drawn, 'culled': culled} for layer, (drawn, culled) in self.layers.items()}
+
+# Repaints and presents only the regions that changed: last frame's moving
+# sprites are cleared back to the static level, and the display is updated
+# with the old and new rects instead of a full flip. A scroll, a change to
+# the ladders or invalidate() falls back to a full frame; a frame that drew
+# nothing presents nothing.
+class DirtyRenderer(Renderer):
+    keeps_rects = True
+    def __init__(self, screen):
+        Renderer.__init__(self, screen)
+        self.full = True
+        self.camera_x = None
+        self.drawn = []
+        self.dirty = []
+    def invalidate(self):
+        self.full = True
+    def clear(self, game):
+        if self.static.sync(game) or self.cx != self.camera_x:
+            self.camera_x = self.cx
+            self.full = True
+        if self.full:
+            self.static.draw(self.cx)
+        else:
+            self.static.draw(self.cx, self.drawn)
+            self.dirty += self.drawn
+        self.drawn = []
+    def mark(self, rects):
+        self.drawn += rects
+        self.dirty += rects
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+        elif self.dirty:
+            pygame.display.update(self.dirty)
+        self.full = False
+        self.dirty = []
+
+# Runs Game with no window and no frame cap. Only the font module is
+# needed (Score builds its font); the display is never opened, so this
+# also works under SDL_VIDEODRIVER=dummy on a CI box. Extra keyword
+# arguments are passed on to Game.
+class Simulation:
+    def __init__(self, seed = None, **options):
+        if not pygame.font.get_init():
+            pygame.font.init()
+        self.game = Game(seed, **options)
+        self.ticks = 0
+        self.score = None
+        self.result = 0
+    def step(self, inputs = Inputs()):
+        score, success = self.game.step(inputs)
+        self.ticks += 1
+        if success:
+            self.score, self.result = score, success
+        return score, success
+    def run(self, inputs = Inputs(), max_ticks = None):
+        while not self.result and (max_ticks is None or self.ticks < max_ticks):
+            self.step(inputs)
+        return self.score, self.result
+    def replay(self, recording):
+        for inputs in recording.inputs():
+            if self.result:
+                break
+            self.step(inputs)
+        return self.score, self.result
+
+def replayHeadless(recording, level = None):
+    sim = Simulation(recording.seed, sim_rate = recording.sim_rate, level = level)
+    start = time.perf_counter()
+    score, result = sim.replay(recording)
+    elapsed = time.perf_counter() - start
+    print(f'seed {recording.seed}: {sim.ticks} ticks, result {result}, score {score}, '
+          f'{sim.ticks / elapsed if elapsed else 0:.0f} ticks/s')
 class Menu:
     class NewGame(pygame.sprite.Sprite):
         def __init__(self):
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((300, 50))
             self.rect = pygame.Rect(490, 150, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (255, 255, 255)
             self.textSurf = self.font.render('New Game', 2, self.color)
             self.image.fill((88, 88, 88))
@@ -565,7 +1991,7 @@ class Menu:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((300, 50))
             self.rect = pygame.Rect(490, 300, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (255, 255, 255)
             self.textSurf = self.font.render('Quit', 2, self.color)
             self.image.fill((88, 88, 88))
@@ -574,8 +2000,7 @@ class Menu:
             pass
     def __init__(self, screen):
         self.screen = screen
-        background = pygame.image.load('Sprites/Menu/background.png')
-        background = rescaleSprite(background, 1)
+        background = loadSprite('Sprites/Menu/background.png', 1)
         self.newgame = self.NewGame()
         self.quit = self.Quit()
         self.screen.blit(background, background.get_rect(topleft = (0, 0)))
@@ -589,7 +2014,7 @@ class GameOver:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((310, 50))
             self.rect = pygame.Rect(485, 400, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (0, 0, 0)
             self.textSurf = self.font.render('Go to Menu', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -601,7 +2026,7 @@ class GameOver:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((310, 50))
             self.rect = pygame.Rect(485, 500, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (0, 0, 0)
             self.textSurf = self.font.render('Quit', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -613,7 +2038,7 @@ class GameOver:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((600, 100))
             self.rect = pygame.Rect(340, 40, 600, 100)
-            self.font = pygame.font.SysFont("Arialblack", 80)
+            self.font = getFont("Arialblack", 80)
             self.color = (255, 255, 0)
             self.textSurf = self.font.render('GAME OVER', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -625,7 +2050,7 @@ class GameOver:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((600, 100))
             self.rect = pygame.Rect(340, 200, 600, 100)
-            self.font = pygame.font.SysFont("Arialblack", 70)
+            self.font = getFont("Arialblack", 70)
             self.color = (255, 255, 255)
             self.textSurf = self.font.render(f'Score: {score}', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -654,7 +2079,7 @@ class Victory:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((310, 50))
             self.rect = pygame.Rect(485, 400, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (0, 0, 0)
             self.textSurf = self.font.render('Go to Menu', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -666,7 +2091,7 @@ class Victory:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((310, 50))
             self.rect = pygame.Rect(485, 500, 300, 50)
-            self.font = pygame.font.SysFont("Arialblack", 50)
+            self.font = getFont("Arialblack", 50)
             self.color = (0, 0, 0)
             self.textSurf = self.font.render('Quit', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -678,7 +2103,7 @@ class Victory:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((600, 100))
             self.rect = pygame.Rect(340, 40, 600, 100)
-            self.font = pygame.font.SysFont("Arialblack", 80)
+            self.font = getFont("Arialblack", 80)
             self.color = (255, 255, 0)
             self.textSurf = self.font.render('VICTORY', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -690,7 +2115,7 @@ class Victory:
             pygame.sprite.Sprite.__init__(self)
             self.image = pygame.Surface((600, 100))
             self.rect = pygame.Rect(340, 200, 600, 100)
-            self.font = pygame.font.SysFont("Arialblack", 70)
+            self.font = getFont("Arialblack", 70)
             self.color = (255, 255, 255)
             self.textSurf = self.font.render(f'Score: {score}', 2, self.color)
             self.image.fill((125, 125, 125))
@@ -713,47 +2138,175 @@ class Victory:
     def update(self):
         pass
 
-pygame.init()
-
-screen = pygame.display.set_mode([SCREEN_WIDTH, SCREEN_HEIGHT])
-pygame.display.set_caption("ANDY'S ADVENTURE")
-clock = pygame.time.Clock()
-menu = Menu(screen)
-game = None
-gameover = None
-vict = None
-running = True
-inGame = False
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == MOUSEBUTTONDOWN:
-            if menu and menu.newgame.rect.collidepoint(event.pos):
-                inGame = True
-                game = Game(screen)
-                menu = None
-            elif menu and menu.quit.rect.collidepoint(event.pos):
-                running = False
-            elif gameover and gameover.go2menu.rect.collidepoint(event.pos):
-                screen.fill((0, 0, 0))
-                menu = Menu(screen)
-            elif gameover and gameover.quit.rect.collidepoint(event.pos):
-                running = False
-            elif vict and vict.go2menu.rect.collidepoint(event.pos):
-                screen.fill((0, 0, 0))
-                menu = Menu(screen)
-            elif vict and vict.quit.rect.collidepoint(event.pos):
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description = "Andy's Adventure")
+    parser.add_argument('--seed', type = int, help = 'seed for level layout and enemy behaviour')
+    parser.add_argument('--record', metavar = 'FILE', help = 'save the inputs of each game to FILE')
+    parser.add_argument('--replay', metavar = 'FILE', help = 'replay a recorded game')
+    parser.add_argument('--headless', action = 'store_true', help = 'with --replay: no window, run as fast as possible')
+    parser.add_argument('--autosave', metavar = 'FILE', help = 'save the game in play to FILE every %d seconds' % AUTOSAVE_SECONDS)
+    parser.add_argument('--resume', metavar = 'FILE', help = 'continue a game saved by --autosave (not recorded)')
+    parser.add_argument('--sim-rate', type = int, default = SIM_RATE, help = 'simulation ticks per second (game speed scales with it)')
+    parser.add_argument('--fps', type = int, default = FPS, help = 'render frames per second')
+    parser.add_argument('--dirty', action = 'store_true', help = 'redraw and present only the parts of the screen that changed')
+    parser.add_argument('--level', metavar = 'FILE', help = 'play a level file (see level.py) instead of a random level')
+    parser.add_argument('--profile', metavar = 'FILE', help = 'on exit, save per-frame phase timings and entity counts to FILE as JSON')
+    parser.add_argument('--trace', metavar = 'FILE', help = 'on exit, save the same timings to FILE as a Chrome trace')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parseArgs(argv)
+    level = Level(args.level) if args.level else None
+    replay = Recording.load(args.replay, level) if args.replay else None
+    if replay:
+        args.sim_rate = replay.sim_rate # play back at the rate it was recorded at
+    if replay and args.headless:
+        replayHeadless(replay, level)
+        return
+    pygame.init()
+
+    screen = pygame.display.set_mode([SCREEN_WIDTH, SCREEN_HEIGHT])
+    pygame.display.set_caption("ANDY'S ADVENTURE")
+    clock = pygame.time.Clock()
+    tick_ms = 1000 / args.sim_rate
+    lag = 0
+    renderer = DirtyRenderer(screen) if args.dirty else Renderer(screen)
+    profiler = Profiler()
+    # a snapshot before every tick, popped one per tick while BACKSPACE is held
+    history = History(REWIND_SECONDS * args.sim_rate)
+    overlay = ProfileOverlay(profiler, args.fps, history)
+    autosave_ticks = AUTOSAVE_SECONDS * args.sim_rate
+    autosaved = 0
+    menu = Menu(screen)
+    game = None
+    gameover = None
+    vict = None
+    running = True
+    inGame = False
+    recording = None
+    replaying = None
+    started = None # when the game in play was started, until its first frame
+    if replay:
+        started = time.perf_counter()
+        inGame = True
+        game = Game(replay.seed, sim_rate = args.sim_rate, level = level)
+        game.interpolate = True
+        game.timer = profiler
+        renderer.timer = profiler
+        replaying = replay.inputs()
+        menu = None
+    elif args.resume:
+        started = time.perf_counter()
+        inGame = True
+        game = SaveFile.load(args.resume, level)
+        game.interpolate = True
+        game.timer = profiler
+        renderer.timer = profiler
+        autosaved = game.ticks
+        menu = None
+    while running:
+        profiler.begin()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
                 running = False
-    if inGame:
-        pressed_keys = pygame.key.get_pressed()
-        score, success = game.update(pressed_keys)
-        if success == -1:
-            gameover = GameOver(screen = screen, score = score)
-            inGame = False
-        elif success == 1:
-            vict = Victory(screen = screen, score = score)
-            inGame = False
-    pygame.display.flip()
-    clock.tick(30)
-pygame.quit()
+            elif event.type == KEYDOWN and event.key == K_F3:
+                overlay.toggle()
+                renderer.invalidate()
+            elif event.type == MOUSEBUTTONDOWN:
+                if menu and menu.newgame.rect.collidepoint(event.pos):
+                    started = time.perf_counter()
+                    inGame = True
+                    game = Game(args.seed, sim_rate = args.sim_rate, level = level)
+                    game.interpolate = True
+                    game.timer = profiler
+                    renderer.timer = profiler
+                    lag = 0
+                    history.clear()
+                    autosaved = 0
+                    renderer.invalidate()
+                    if args.record:
+                        recording = Recording(game.seed, sim_rate = game.sim_rate, level = level)
+                    menu = None
+                elif menu and menu.quit.rect.collidepoint(event.pos):
+                    running = False
+                elif gameover and gameover.go2menu.rect.collidepoint(event.pos):
+                    screen.fill((0, 0, 0))
+                    menu = Menu(screen)
+                    renderer.invalidate()
+                elif gameover and gameover.quit.rect.collidepoint(event.pos):
+                    running = False
+                elif vict and vict.go2menu.rect.collidepoint(event.pos):
+                    screen.fill((0, 0, 0))
+                    menu = Menu(screen)
+                    renderer.invalidate()
+                elif vict and vict.quit.rect.collidepoint(event.pos):
+                    running = False
+        profiler.mark('events')
+        if inGame:
+            # Fixed timestep: run as many ticks as real time calls for, at
+            # most MAX_CATCHUP per frame, then draw part way to the next one.
+            success = 0
+            steps = 0
+            while lag >= tick_ms and steps < MAX_CATCHUP and not success:
+                if replaying:
+                    pressed_keys = next(replaying, _masks[0])
+                else:
+                    pressed_keys = pygame.key.get_pressed()
+                if not replaying and pressed_keys[K_BACKSPACE]:
+                    if history:
+                        data, mark = history.pop()
+                        game.restore(data)
+                        if recording:
+                            del recording.masks[mark:]
+                        autosaved = min(autosaved, game.ticks)
+                else:
+                    # a paused tick (or the one that pauses) changes nothing worth rewinding to
+                    if not replaying and game.isPaused == bool(pressed_keys[K_DOWN]):
+                        history.push(game.snapshot(), len(recording.masks) if recording else None)
+                    if recording:
+                        recording.record(pressed_keys)
+                    score, success = game.step(pressed_keys)
+                    if args.autosave and not success and game.ticks - autosaved >= autosave_ticks:
+                        SaveFile.save(args.autosave, game)
+                        autosaved = game.ticks
+                lag -= tick_ms
+                steps += 1
+            if steps == MAX_CATCHUP:
+                lag = min(lag, tick_ms)
+            renderer.draw(game, 1 if success else lag / tick_ms)
+            if overlay.visible:
+                renderer.mark([overlay.draw(screen)])
+                profiler.mark('draw')
+            if success == -1:
+                gameover = GameOver(screen = screen, score = score)
+                renderer.invalidate()
+                inGame = False
+            elif success == 1:
+                vict = Victory(screen = screen, score = score)
+                renderer.invalidate()
+                inGame = False
+            if recording and not inGame:
+                recording.save(args.record)
+                recording = None
+        renderer.present()
+        profiler.mark('present')
+        if profiler.first_frame is None:
+            profiler.first_frame = time.perf_counter() - START
+            if menu:
+                preload()
+        if started is not None and inGame:
+            profiler.game_start = time.perf_counter() - started
+            started = None
+        lag += clock.tick(args.fps)
+        profiler.mark('wait')
+        profiler.end(game if inGame else None, renderer)
+    if recording:
+        recording.save(args.record)
+    if args.profile:
+        profiler.save(args.profile)
+    if args.trace:
+        profiler.saveTrace(args.trace)
+    pygame.quit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+# Level files: a header, an index, then fixed-size platform, spawn and
+# item records. Each section is sorted into strips of `bucket` px by x,
+# keeping the given order within a strip (it is the spawn order). A
+# platform is listed again under every further strip it reaches into, so
+# a strip's records hold everything that shows inside it; readers of
+# more than one strip drop the repeats. The index gives, for every strip,
+# where its records start in each section, so the records of a strip are
+# read straight out of the memory-mapped file and the rest of the level
+# is never touched.
+#
+#   header   magic, version, width, bucket, record counts
+#   index    (buckets + 1) x (platform, spawn, item) start records
+#   records  platforms, then spawns, then items
+BUCKET_WIDTH = 1280
+
+PLATFORM = struct.Struct('<iiHHBBBx') # x, y, width, height, r, g, b
+SPAWN = struct.Struct('<iiHH') # x, y, kind, hp (0: the kind's default)
+ITEM = struct.Struct('<iiB3x') # x, y, kind
+INDEX = struct.Struct('<III')
+
+SPAWN_KINDS = ('enemy',)
+ITEM_KINDS = ('coin', 'powerup')
+
+class Level:
+    MAGIC = b'AALV'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHxxIIIII')
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if len(self.data) < self.HEADER.size:
+            raise ValueError(f'{path} is not a level file')
+        magic, version, self.width, self.bucket, *counts = self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'{path} is not a version {self.VERSION} level')
+        self.counts = counts
+        self.buckets = -(-self.width // self.bucket)
+        self.sections = []
+        offset = self.HEADER.size + (self.buckets + 1) * INDEX.size
+        for record, count in zip((PLATFORM, SPAWN, ITEM), counts):
+            self.sections.append((record, offset))
+            offset += record.size * count
+        if len(self.data) < offset:
+            raise ValueError(f'{path} is truncated')
+    def close(self):
+        self.data.close()
+    # Records of buckets first..last (inclusive) in one section.
+    def region(self, section, first, last):
+        first = max(first, 0)
+        last = min(last, self.buckets - 1)
+        if first > last:
+            return []
+        index = self.HEADER.size
+        start = INDEX.unpack_from(self.data, index + first * INDEX.size)[section]
+        end = INDEX.unpack_from(self.data, index + (last + 1) * INDEX.size)[section]
+        record, offset = self.sections[section]
+        return list(record.iter_unpack(self.data[offset + start * record.size:offset + end * record.size]))
+    def platforms(self, first, last = None):
+        return self.region(0, first, first if last is None else last)
+    def spawns(self, first, last = None):
+        return self.region(1, first, first if last is None else last)
+    def items(self, first, last = None):
+        return self.region(2, first, first if last is None else last)
+    def all(self, section):
+        records = self.region(section, 0, self.buckets - 1)
+        return list(dict.fromkeys(records)) if section == 0 else records
+
+    @classmethod
+    def save(cls, path, width, platforms, spawns, items, bucket = BUCKET_WIDTH):
+        buckets = -(-width // bucket)
+        def bucketOf(x):
+            return min(max(x // bucket, 0), buckets - 1)
+        # (strip, first strip, record): platforms under each strip from their
+        # left to their right edge. Within a strip, repeats come first in the
+        # order of the strip they start in, so a JSON round trip keeps the bytes.
+        platforms = [(b, bucketOf(p[0]), p) for p in platforms for b in range(bucketOf(p[0]), bucketOf(p[0] + max(p[2], 1) - 1) + 1)]
+        spawns = [(bucketOf(s[0]), bucketOf(s[0]), s) for s in spawns]
+        items = [(bucketOf(i[0]), bucketOf(i[0]), i) for i in items]
+        sections = []
+        for records in (platforms, spawns, items):
+            records = sorted(records, key = lambda entry: entry[:2])
+            starts = [0] * (buckets + 1)
+            for b, first, record in records:
+                starts[b + 1] += 1
+            for b in range(buckets):
+                starts[b + 1] += starts[b]
+            sections.append(([record for b, first, record in records], starts))
+        with open(path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, width, bucket, len(platforms), len(spawns), len(items)))
+            for b in range(buckets + 1):
+                f.write(INDEX.pack(*(starts[b] for records, starts in sections)))
+            for record, (records, starts) in zip((PLATFORM, SPAWN, ITEM), sections):
+                for fields in records:
+                    f.write(record.pack(*fields))
+
+# The human-editable form.
+def toJson(level):
+    return {
+        'version': Level.VERSION,
+        'width': level.width,
+        'bucket': level.bucket,
+        'platforms': [{'x': x, 'y': y, 'width': w, 'height': h, 'color': [r, g, b]} for x, y, w, h, r, g, b in level.all(0)],
+        'spawns': [{'x': x, 'y': y, 'kind': SPAWN_KINDS[kind], 'hp': hp} for x, y, kind, hp in level.all(1)],
+        'items': [{'x': x, 'y': y, 'kind': ITEM_KINDS[kind]} for x, y, kind in level.all(2)],
+    }
+
+def fromJson(data, path):
+    platforms = [(p['x'], p['y'], p['width'], p['height'], *p.get('color', (255, 0, 0))) for p in data['platforms']]
+    spawns = [(s['x'], s['y'], SPAWN_KINDS.index(s.get('kind', 'enemy')), s.get('hp', 0)) for s in data.get('spawns', [])]
+    items = [(i['x'], i['y'], ITEM_KINDS.index(i['kind'])) for i in data.get('items', [])]
+    Level.save(path, data['width'], platforms, spawns, items, data.get('bucket', BUCKET_WIDTH))
+
+# The layout a Game would stream for this seed, written out as a level.
+def generate(args):
+    from game import generateChunk
+    buckets = -(-args.width // BUCKET_WIDTH)
+    platforms = []
+    spawns = []
+    for i in range(buckets):
+        ladders, enemies = generateChunk(args.seed, i, BUCKET_WIDTH, buckets, args.enemies, args.ladders, args.width)
+        platforms += [(x, y, w, h, 255, 0, 0) for x, y, w, h in ladders]
+        spawns += [(x, y, 0, 0) for x, y in enemies]
+    Level.save(args.out, args.width, platforms, spawns, [])
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description = 'Convert and generate level files.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    command = commands.add_parser('tojson', help = 'write a level file as JSON')
+    command.add_argument('level')
+    command.add_argument('out', nargs = '?', help = 'default: stdout')
+    command = commands.add_parser('fromjson', help = 'build a level file from JSON')
+    command.add_argument('json')
+    command.add_argument('out')
+    command = commands.add_parser('generate', help = 'write the random level of a seed')
+    command.add_argument('out')
+    command.add_argument('--seed', type = int, default = 1)
+    command.add_argument('--width', type = int, default = 1280*5)
+    command.add_argument('--enemies', type = int, default = 50)
+    command.add_argument('--ladders', type = int, default = 3, help = 'ladders per screen')
+    command = commands.add_parser('info', help = 'print a level file\'s header')
+    command.add_argument('level')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parseArgs(argv)
+    if args.command == 'tojson':
+        level = Level(args.level)
+        text = json.dumps(toJson(level), indent = 1)
+        level.close()
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+    elif args.command == 'fromjson':
+        with open(args.json) as f:
+            fromJson(json.load(f), args.out)
+    elif args.command == 'generate':
+        generate(args)
+    elif args.command == 'info':
+        level = Level(args.level)
+        print(f'{args.level}: version {level.VERSION}, {level.width} px in {level.buckets} buckets of {level.bucket}, '
+              f'{level.counts[0]} platform records, {level.counts[1]} spawns, {level.counts[2]} items')
+        level.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+# Sprites are loaded by paths relative to the repository root.
+@pytest.fixture(autouse = True)
+def root(monkeypatch):
+    monkeypatch.chdir(ROOT)
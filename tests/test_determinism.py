@@ -0,0 +1,95 @@
+import pytest
+
+import game
+import level
+from batch import RandomBot, ScriptedBot
+from game import Game
+
+# The keys a bot held on every tick of a session, and the snapshot after each.
+def play(g, bot, ticks):
+    inputs = []
+    states = []
+    for tick in range(ticks):
+        keys = bot(g, tick)
+        score, result = g.step(keys)
+        inputs.append(keys)
+        states.append(g.snapshot())
+        if result:
+            break
+    return inputs, states
+
+def follow(g, inputs):
+    states = []
+    for keys in inputs:
+        g.step(keys)
+        states.append(g.snapshot())
+    return states
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_restore_into_fresh_game(seed):
+    inputs, states = play(Game(seed), RandomBot(seed), 400)
+    k = len(states) // 3
+    g = Game(seed)
+    g.restore(states[k])
+    assert g.snapshot() == states[k]
+    assert follow(g, inputs[k + 1:]) == states[k + 1:]
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_restore_into_advanced_game(seed):
+    inputs, states = play(Game(seed), RandomBot(seed), 400)
+    k = len(states) // 3
+    g = Game(seed)
+    play(g, ScriptedBot(seed), 300) # somewhere else in the level, other chunks loaded
+    g.restore(states[k])
+    assert g.snapshot() == states[k]
+    assert follow(g, inputs[k + 1:]) == states[k + 1:]
+
+def test_snapshot_after_victory():
+    g = Game(5)
+    g.player.hurted = lambda dam: False
+    g.player.num_bullets = 5
+    g.clearEnemies()
+    inputs, states = play(g, lambda g, tick: game.Inputs(), 2000)
+    assert g.victory and g.boss.slot is None
+    fresh = Game(5)
+    fresh.restore(states[-1])
+    assert fresh.victory and fresh.boss.slot is None
+    assert fresh.snapshot() == states[-1]
+    g.restore(states[-50]) # the boss comes back
+    assert g.boss.slot is not None
+    assert follow(g, inputs[-49:]) == states[-49:]
+
+def test_level_json_round_trip(tmp_path):
+    path = str(tmp_path / 'a.lvl')
+    level.main(['generate', path, '--seed', '3'])
+    # and a platform wider than a strip, which is listed under each strip it reaches
+    lv = level.Level(path)
+    data = level.toJson(lv)
+    lv.close()
+    data['platforms'].append({'x': 100, 'y': 400, 'width': 3000, 'height': 20, 'color': [0, 255, 0]})
+    data['items'].append({'x': 500, 'y': 300, 'kind': 'coin'})
+    level.fromJson(data, path)
+    lv = level.Level(path)
+    data = level.toJson(lv)
+    lv.close()
+    level.fromJson(data, str(tmp_path / 'b.lvl'))
+    assert (tmp_path / 'a.lvl').read_bytes() == (tmp_path / 'b.lvl').read_bytes()
+
+@pytest.mark.parametrize('Bot', [RandomBot, ScriptedBot])
+def test_generated_level_plays_like_random(tmp_path, Bot):
+    path = str(tmp_path / 'gen.lvl')
+    level.main(['generate', path, '--seed', '4'])
+    inputs, states = play(Game(4), Bot(4), 600)
+    assert follow(Game(4, level = level.Level(path)), inputs) == states
+
+# Bodies.step and Swarm move small batches one actor at a time and large
+# ones with NumPy; both ways must give the same game.
+@pytest.mark.parametrize('seed', [1, 3])
+def test_batch_paths_match(monkeypatch, seed):
+    def run(batch_min):
+        monkeypatch.setattr(game, 'BATCH_MIN', batch_min)
+        monkeypatch.setattr(game, 'AI_BATCH_MIN', batch_min)
+        g = Game(seed, num_enemy = 150, active_margin = None)
+        g.player.hurted = lambda dam: False
+        return play(g, RandomBot(seed), 300)[1]
+    assert run(0) == run(1 << 30)